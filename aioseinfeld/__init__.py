@@ -17,5 +17,9 @@ from .types import (
     Seasons,
     Quote,
     Passage,
+    Page,
+    QueryEvent,
+    QueryStats,
+    Tuning,
     Name,
 )
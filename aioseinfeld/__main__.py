@@ -0,0 +1,39 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT License
+
+import argparse
+import sys
+from pathlib import Path
+from typing import Optional, Sequence
+
+from .compiler import compile_database, PAGE_SIZE
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m aioseinfeld")
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+    compile_parser = commands.add_parser(
+        "compile", help="write an optimized, read-only copy of a database"
+    )
+    compile_parser.add_argument("source", type=Path, help="database to compile")
+    compile_parser.add_argument("destination", type=Path, help="file to create")
+    compile_parser.add_argument(
+        "--page-size",
+        type=int,
+        default=PAGE_SIZE,
+        help=f"page size of the compiled database (default {PAGE_SIZE})",
+    )
+    args = parser.parse_args(argv)
+
+    if args.command == "compile":
+        try:
+            compile_database(args.source, args.destination, page_size=args.page_size)
+        except ValueError as e:
+            parser.exit(1, f"error: {e}\n")
+    else:
+        parser.print_help(sys.stderr)
+        parser.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,423 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT License
+
+"""
+Benchmark every public `Seinfeld` method, with cold and warm caches.
+
+Run `python -m aioseinfeld.bench --help` for options. Without a database path, a
+synthetic database is generated with `aioseinfeld.corpus`. Results are written as
+JSON, and two result files can be compared with `--compare`. Use `--tuning sweep`
+to measure each connection setting of `aioseinfeld.Tuning` on its own.
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import re
+import sqlite3
+import statistics
+import sys
+import time
+from dataclasses import asdict, dataclass, fields, replace
+from fnmatch import fnmatch
+from itertools import product
+from pathlib import Path
+from random import Random
+from tempfile import TemporaryDirectory
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import aiosqlite
+
+from .__version__ import __version__
+from .corpus import EPISODES, generate
+from .seinfeld import Seinfeld
+from .types import Quote, Tuning
+
+Case = Callable[[Seinfeld, Random], Awaitable[Any]]
+
+
+@dataclass
+class Sample:
+    """Inputs for benchmark cases, chosen once from the database being measured"""
+
+    ids: List[int]
+    episode_ids: List[int]
+    seeds: List[Quote]
+    speaker: str
+    subject: str
+
+
+async def sample(seinfeld: Seinfeld, rng: Random) -> Sample:
+    quotes = [q async for q in seinfeld.iter_search(random=True, limit=500)]
+    speakers: Dict[str, int] = {}
+    words: Dict[str, int] = {}
+    for quote in quotes:
+        speakers[quote.speaker.id] = speakers.get(quote.speaker.id, 0) + 1
+        for word in re.findall(r"\w{4,}", quote.text.lower()):
+            words[word] = words.get(word, 0) + 1
+
+    return Sample(
+        ids=[quote.id for quote in quotes],
+        episode_ids=[episode.id for episode in await seinfeld.episodes()],
+        seeds=quotes[:50],
+        speaker=max(speakers, key=lambda k: speakers[k]),
+        subject=max(words, key=lambda k: words[k]) if words else "the",
+    )
+
+
+def cases(sample: Sample, limits: Sequence[int]) -> Dict[str, Case]:
+    """All benchmark cases, by name"""
+    result: Dict[str, Case] = {
+        "speakers": lambda s, r: s.speakers(),
+        "speaker": lambda s, r: s.speaker(sample.speaker),
+        "seasons": lambda s, r: s.seasons(),
+        "season": lambda s, r: s.season(1),
+        "episodes": lambda s, r: s.episodes(),
+        "episodes[season]": lambda s, r: s.episodes(1),
+        "episode": lambda s, r: s.episode(r.choice(sample.episode_ids)),
+        "quote": lambda s, r: s.quote(r.choice(sample.ids)),
+        "quotes[50]": lambda s, r: s.quotes(r.sample(sample.ids, 50)),
+        "passage": lambda s, r: s.passage(r.choice(sample.seeds)),
+        "passages[50]": lambda s, r: s.passages(sample.seeds),
+    }
+
+    def search(**kwargs: Any) -> Case:
+        return lambda s, r: s.search(**kwargs)
+
+    def search_page(**kwargs: Any) -> Case:
+        return lambda s, r: s.search_page(**kwargs)
+
+    def iter_search(**kwargs: Any) -> Case:
+        async def case(s: Seinfeld, r: Random) -> None:
+            async for _ in s.iter_search(**kwargs):
+                pass
+
+        return case
+
+    def random(**kwargs: Any) -> Case:
+        return lambda s, r: s.random(**kwargs)
+
+    orders = {"asc": {}, "reverse": {"reverse": True}, "random": {"random": True}}
+    for speaker, subject, order, limit in product(
+        (None, sample.speaker), (None, sample.subject), orders, limits
+    ):
+        filters = {"speaker": speaker, "subject": subject}
+        tags = ",".join(k for k, v in filters.items() if v)
+        name = f"search[{tags or 'all'};{order};limit={limit}]"
+        result[name] = search(**filters, **orders[order], limit=limit)
+
+        if order != "random":
+            name = f"search_page[{tags or 'all'};{order};limit={limit or 10}]"
+            result[name] = search_page(**filters, **orders[order], limit=limit or 10)
+
+    for speaker, subject in product((None, sample.speaker), (None, sample.subject)):
+        filters = {"speaker": speaker, "subject": subject}
+        tags = ",".join(k for k, v in filters.items() if v)
+        result[f"iter_search[{tags or 'all'};limit=500]"] = iter_search(
+            **filters, limit=500
+        )
+        result[f"random[{tags or 'all'}]"] = random(**filters)
+
+    return result
+
+
+def tuning_profiles() -> Dict[str, Optional[Tuning]]:
+    """No tuning, then each default setting of `Tuning` on its own, then all of them"""
+    tuned = Tuning()
+    off = Tuning(
+        immutable=False,
+        mmap_size=None,
+        cache_size=None,
+        temp_store=None,
+        query_only=False,
+    )
+    profiles: Dict[str, Optional[Tuning]] = {"untuned": None}
+    for field in fields(Tuning):
+        profiles[field.name] = replace(off, **{field.name: getattr(tuned, field.name)})
+    profiles["tuned"] = tuned
+    return profiles
+
+
+def summarize(latencies: List[float], elapsed: float) -> Dict[str, float]:
+    ordered = sorted(latencies)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    return {
+        "count": len(ordered),
+        "mean": statistics.mean(ordered),
+        "p50": percentile(50),
+        "p90": percentile(90),
+        "p99": percentile(99),
+        "max": ordered[-1],
+        "throughput": len(ordered) / elapsed if elapsed else 0.0,
+    }
+
+
+async def measure(
+    seinfeld: Seinfeld, case: Case, iterations: int, concurrency: int, rng: Random
+) -> Dict[str, float]:
+    latencies: List[float] = []
+    remaining = iterations
+
+    async def worker() -> None:
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            before = time.perf_counter()
+            await case(seinfeld, rng)
+            latencies.append(time.perf_counter() - before)
+
+    before = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return summarize(latencies, time.perf_counter() - before)
+
+
+async def run(
+    db_path: Path,
+    options: Dict[str, Any],
+    include: Sequence[str],
+    concurrency: Sequence[int],
+    iterations: int,
+    cold_runs: int,
+    limits: Sequence[int],
+    seed: int,
+) -> List[Dict[str, Any]]:
+    rng = Random(seed)
+    results: List[Dict[str, Any]] = []
+
+    def record(case: str, mode: str, level: int, stats: Dict[str, float]) -> None:
+        results.append(
+            {"case": case, "mode": mode, "concurrency": level, **stats},
+        )
+        print(
+            f"{case:<45} {mode:<4} x{level:<3} "
+            f"p50 {stats['p50'] * 1000:9.3f}ms  p99 {stats['p99'] * 1000:9.3f}ms  "
+            f"{stats['throughput']:10.1f}/s",
+            file=sys.stderr,
+        )
+
+    async with Seinfeld(db_path, **options) as seinfeld:
+        selected = {
+            name: case
+            for name, case in cases(await sample(seinfeld, rng), limits).items()
+            if not include or any(fnmatch(name, pattern) for pattern in include)
+        }
+
+        # warm: caches are filled by a first call before measuring
+        for name, case in selected.items():
+            await case(seinfeld, rng)
+            for level in concurrency:
+                stats = await measure(seinfeld, case, iterations, level, rng)
+                record(name, "warm", level, stats)
+
+    # cold: the first call on a freshly opened instance, including opening it
+    opens: List[float] = []
+    firsts: Dict[str, List[float]] = {name: [] for name in selected}
+    for _ in range(cold_runs):
+        for name, case in selected.items():
+            before = time.perf_counter()
+            async with Seinfeld(db_path, **options) as seinfeld:
+                opened = time.perf_counter()
+                await case(seinfeld, rng)
+                firsts[name].append(time.perf_counter() - opened)
+            opens.append(opened - before)
+
+    if opens:
+        record("open", "cold", 1, summarize(opens, sum(opens)))
+    for name, latencies in firsts.items():
+        record(name, "cold", 1, summarize(latencies, sum(latencies)))
+
+    return results
+
+
+async def snapshot(db_path: Path, path: Path) -> Path:
+    async with Seinfeld(db_path) as seinfeld:
+        return await seinfeld.snapshot(path)
+
+
+def compare(old_path: Path, new_path: Path) -> None:
+    """Print the change in median latency for every case in both result files"""
+    old = json.loads(old_path.read_text())
+    new = json.loads(new_path.read_text())
+
+    def key(r: Dict[str, Any]) -> Tuple[str, str, int, str]:
+        return (r["case"], r["mode"], r["concurrency"], r.get("profile", ""))
+
+    before = {key(r): r for r in old["results"]}
+    for result in new["results"]:
+        k = key(result)
+        if k not in before:
+            continue
+        ratio = result["p50"] / before[k]["p50"] if before[k]["p50"] else 0.0
+        print(
+            f"{k[3] + ' ' if k[3] else ''}{k[0]:<45} {k[1]:<4} x{k[2]:<3} "
+            f"p50 {before[k]['p50'] * 1000:9.3f}ms -> "
+            f"{result['p50'] * 1000:9.3f}ms  ({ratio:.2f}x)"
+        )
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m aioseinfeld.bench", description=__doc__.strip().split("\n")[0]
+    )
+    parser.add_argument(
+        "db_path",
+        nargs="?",
+        type=Path,
+        help="database to measure (default: generate a synthetic database)",
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="size of the generated synthetic database (default 1.0)",
+    )
+    parser.add_argument(
+        "-k",
+        "--case",
+        action="append",
+        default=[],
+        help="only run cases matching this glob pattern, can be repeated",
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        nargs="+",
+        default=[1, 4, 16],
+        help="concurrent tasks for warm cases (default 1 4 16)",
+    )
+    parser.add_argument(
+        "-n",
+        "--iterations",
+        type=int,
+        default=100,
+        help="calls per warm case and concurrency (default 100)",
+    )
+    parser.add_argument(
+        "--cold-runs",
+        type=int,
+        default=3,
+        help="fresh instances per cold case (default 3)",
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        nargs="+",
+        default=[10],
+        help="search limits to measure, 0 for unlimited (default 10)",
+    )
+    parser.add_argument("--materialize", action="store_true")
+    parser.add_argument("--pool-size", type=int, default=1)
+    parser.add_argument("--in-memory", action="store_true")
+    parser.add_argument(
+        "--engine",
+        choices=("sqlite", "columnar", "snapshot"),
+        default="sqlite",
+        help="snapshot writes a snapshot file, and opens it (default sqlite)",
+    )
+    parser.add_argument("--instrument", action="store_true")
+    parser.add_argument(
+        "--tuning",
+        choices=("off", "on", "sweep"),
+        default="off",
+        help="open with the default Tuning, or measure each setting on its own "
+        "against search and passage cases (default off)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "-o", "--output", type=Path, help="write JSON results to this file"
+    )
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        type=Path,
+        metavar=("OLD", "NEW"),
+        help="compare two JSON result files, instead of running benchmarks",
+    )
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    options = {
+        "materialize": args.materialize,
+        "pool_size": args.pool_size,
+        "in_memory": args.in_memory,
+        "instrument": args.instrument,
+        "engine": "sqlite" if args.engine == "sqlite" else "columnar",
+    }
+
+    profiles: Dict[str, Optional[Tuning]] = {"": None}
+    include = args.case
+    if args.tuning == "on":
+        profiles = {"": Tuning()}
+    elif args.tuning == "sweep":
+        profiles = tuning_profiles()
+        include = include or ["search*", "passage*"]
+
+    results: List[Dict[str, Any]] = []
+    with TemporaryDirectory() as td:
+        db_path = args.db_path
+        if db_path is None:
+            db_path = generate(
+                Path(td) / "synthetic.db",
+                episodes=max(1, round(EPISODES * args.scale)),
+                seed=args.seed,
+            )
+        if args.engine == "snapshot":
+            path = asyncio.run(snapshot(db_path, Path(td) / "bench.snapshot"))
+            options["snapshot"] = str(path)
+
+        for profile, tuning in profiles.items():
+            if profile:
+                print(f"tuning profile: {profile}", file=sys.stderr)
+            for result in asyncio.run(
+                run(
+                    db_path,
+                    {**options, "tuning": tuning},
+                    include=include,
+                    concurrency=args.concurrency,
+                    iterations=args.iterations,
+                    cold_runs=args.cold_runs,
+                    limits=args.limit,
+                    seed=args.seed,
+                )
+            ):
+                if profile:
+                    result["profile"] = profile
+                results.append(result)
+
+    output = {
+        "meta": {
+            "version": __version__,
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "aiosqlite": getattr(aiosqlite, "__version__", "unknown"),
+            "platform": platform.platform(),
+            "timestamp": time.time(),
+            "db_path": str(args.db_path) if args.db_path else None,
+            "scale": None if args.db_path else args.scale,
+            "options": options,
+            "tuning": {
+                profile: asdict(tuning) if tuning else None
+                for profile, tuning in profiles.items()
+            },
+            "iterations": args.iterations,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    text = json.dumps(output, indent=2)
+    if args.output:
+        args.output.write_text(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT License
+
+"""
+Columnar copy of every quote, for answering lookups and searches in-process.
+
+Columns can be saved to a flat snapshot file, and mapped back read-only, so that
+many processes share one copy of the corpus through the page cache.
+"""
+
+import os
+import re
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
+from mmap import ACCESS_READ, ALLOCATIONGRANULARITY, mmap
+from pathlib import Path
+from random import randrange, sample
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Pattern,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+# same columns, in the same order, as `QUOTE_COLUMNS`
+QuoteRow = Tuple[int, int, int, str, str]
+
+# text buffers are bytes when built, or mapped from a snapshot file
+Text = Union[bytes, mmap]
+
+# mapped files start with a header and a table of (offset, size) sections
+VERSION = 1
+BYTE_ORDER = 0x01020304
+HEADER = struct.Struct("=8sIII")
+SECTION = struct.Struct("=QQ")
+
+# snapshot sections are every array below in order, speaker names, text, and folded
+MAGIC = b"AIOSEINF"
+ARRAYS = (
+    ("ids", "i"),
+    ("episode_ids", "i"),
+    ("numbers", "i"),
+    ("codes", "H"),
+    ("offsets", "I"),
+    ("by_id", "I"),
+    ("speaker_rows", "I"),
+    ("speaker_starts", "I"),
+)
+
+# one UTF-8 character, other than the separator between texts
+ANY_CHAR = rb"(?:[\x01-\x7f]|[\xc0-\xff][\x80-\xbf]*)"
+
+
+def write_sections(
+    path: Union[str, Path], magic: bytes, arrays: Sequence[Any], texts: Sequence[Any]
+) -> None:
+    """
+    Write buffers to a file of sections, that `map_sections()` can map read-only.
+
+    Texts are aligned so that they can each be mapped on their own. The file is
+    written to a temporary name first, and then replaces `path` atomically.
+    """
+    path = Path(path)
+    buffers = [memoryview(array).cast("B") for array in arrays] + list(texts)
+
+    sections: List[Tuple[int, int]] = []
+    position = HEADER.size + SECTION.size * len(buffers)
+    for index, buffer in enumerate(buffers):
+        align = ALLOCATIONGRANULARITY if index >= len(arrays) else 8
+        position = -(-position // align) * align
+        sections.append((position, len(buffer)))
+        position += len(buffer)
+
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(magic, VERSION, BYTE_ORDER, len(buffers)))
+        for section in sections:
+            f.write(SECTION.pack(*section))
+        for (offset, _), buffer in zip(sections, buffers):
+            f.seek(offset)
+            f.write(buffer)
+    os.replace(tmp_path, path)
+
+
+def map_sections(
+    path: Union[str, Path],
+    magic: bytes,
+    kind: str,
+    typecodes: Sequence[str],
+    texts: int,
+) -> Tuple[List[memoryview], List[Text], Callable[[], None]]:
+    """
+    Map a file written by `write_sections()`, without reading or copying it.
+
+    Returns a view of each array with the given typecodes, each text as its own map
+    for the find methods of mmap objects, and a function that unmaps all of them.
+    """
+    with open(path, "rb") as f:
+        whole = mmap(f.fileno(), 0, access=ACCESS_READ)
+        try:
+            header = HEADER.unpack_from(whole)
+            sections = [
+                SECTION.unpack_from(whole, HEADER.size + index * SECTION.size)
+                for index in range(header[3])
+            ]
+        except struct.error:
+            header = (b"", 0, 0, 0)
+        if header != (magic, VERSION, BYTE_ORDER, len(typecodes) + texts):
+            whole.close()
+            raise ValueError(f"{str(path)!r} is not a compatible {kind} file")
+
+        view = memoryview(whole)
+        views: List[memoryview] = [
+            view[offset : offset + size].cast(typecode)  # type: ignore
+            for typecode, (offset, size) in zip(typecodes, sections)
+        ]
+        maps: List[Text] = [
+            mmap(f.fileno(), size, access=ACCESS_READ, offset=offset) if size else b""
+            for offset, size in sections[len(typecodes) :]
+        ]
+
+    def close() -> None:
+        for buffer in views + [view]:
+            buffer.release()
+        for mapped in maps + [whole]:
+            if isinstance(mapped, mmap):
+                mapped.close()
+
+    return list(views), list(maps), close
+
+
+def bisect(count: int, key: Callable[[int], Any], value: Any) -> int:
+    """Index of the first item in `range(count)` with `key(index) >= value`"""
+    lo, hi = 0, count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if key(mid) < value:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def like_pattern(subject: str) -> Optional[Pattern[bytes]]:
+    """
+    Compile a subject with `LIKE` wildcards into a regex over folded UTF-8 text.
+
+    Returns None when the subject has no `%` or `_`, and can be found directly.
+    """
+    if "%" not in subject and "_" not in subject:
+        return None
+    parts = re.split(r"([%_])", subject)
+    return re.compile(
+        b"".join(
+            ANY_CHAR + b"*"
+            if part == "%"
+            else ANY_CHAR
+            if part == "_"
+            else re.escape(part.encode().lower())
+            for part in parts
+        )
+    )
+
+
+class Columns:
+    """
+    Every quote, as parallel arrays in episode and utterance order.
+
+    Speakers are stored as codes into a list of names, and texts are concatenated
+    into one UTF-8 buffer, separated by NUL bytes. A second buffer has the same text
+    lowercased in ASCII only, which is how SQLite `LIKE` folds case, so subjects are
+    found with `bytes.find()` and mapped back to rows by bisecting the offsets.
+    """
+
+    def __init__(
+        self,
+        ids: Sequence[int],
+        episode_ids: Sequence[int],
+        numbers: Sequence[int],
+        codes: Sequence[int],
+        speakers: List[str],
+        offsets: Sequence[int],
+        text: Text,
+        folded: Text,
+        by_id: Sequence[int],
+        speaker_rows: Sequence[int],
+        speaker_starts: Sequence[int],
+        close: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.ids = ids
+        self.episode_ids = episode_ids
+        self.numbers = numbers
+        self.codes = codes
+        self.speakers = speakers
+        self.offsets = offsets
+        self.text = text
+        self.folded = folded
+        self.by_id = by_id
+        self.speaker_rows = speaker_rows
+        self.speaker_starts = speaker_starts
+        self.speaker_codes = {name: code for code, name in enumerate(speakers)}
+        self._close = close
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Sequence[Any]]) -> "Columns":
+        """Build columns from quote rows, already in episode and utterance order"""
+        ids = array("i")
+        episode_ids = array("i")
+        numbers = array("i")
+        codes = array("H")
+        speakers: Dict[str, int] = {}
+        offsets = array("I", [0])
+        texts: List[bytes] = []
+
+        for id, episode_id, number, speaker, text in rows:
+            ids.append(id)
+            episode_ids.append(episode_id)
+            numbers.append(number)
+            codes.append(speakers.setdefault(speaker, len(speakers)))
+            data = (text or "").encode() + b"\x00"
+            texts.append(data)
+            offsets.append(offsets[-1] + len(data))
+
+        # row indices ordered by quote id, and grouped by speaker
+        by_id = array("I", sorted(range(len(ids)), key=ids.__getitem__))
+        speaker_rows = array(
+            "I", sorted(range(len(codes)), key=lambda i: (codes[i], i))
+        )
+        speaker_starts = array("I", [0] * (len(speakers) + 1))
+        for code in codes:
+            speaker_starts[code + 1] += 1
+        for code in range(len(speakers)):
+            speaker_starts[code + 1] += speaker_starts[code]
+
+        text = b"".join(texts)
+        return cls(
+            ids,
+            episode_ids,
+            numbers,
+            codes,
+            list(speakers),
+            offsets,
+            text,
+            text.lower(),
+            by_id,
+            speaker_rows,
+            speaker_starts,
+        )
+
+    @classmethod
+    def open(cls, path: Union[str, Path]) -> "Columns":
+        """
+        Map a snapshot file written by `save()`, without reading or copying it.
+
+        Call `close()` when finished, to unmap the file.
+        """
+        typecodes = [typecode for _, typecode in ARRAYS] + ["B"]
+        arrays, texts, close = map_sections(path, MAGIC, "snapshot", typecodes, 2)
+        ids, episode_ids, numbers, codes, offsets, by_id, rows, starts, names = arrays
+        speakers = str(names, "utf-8")
+        return cls(
+            ids,
+            episode_ids,
+            numbers,
+            codes,
+            speakers.split("\x00") if speakers else [],
+            offsets,
+            texts[0],
+            texts[1],
+            by_id,
+            rows,
+            starts,
+            close,
+        )
+
+    def save(self, path: Union[str, Path]) -> None:
+        """Write every column to a snapshot file, replacing it atomically"""
+        arrays = [getattr(self, name) for name, _ in ARRAYS]
+        arrays.append("\x00".join(self.speakers).encode())
+        write_sections(path, MAGIC, arrays, [self.text, self.folded])
+
+    def close(self) -> None:
+        """Unmap the snapshot file, if these columns were opened from one"""
+        if self._close is not None:
+            self._close()
+            self._close = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def row(self, index: int) -> QuoteRow:
+        start, end = self.offsets[index], self.offsets[index + 1] - 1
+        return (
+            self.ids[index],
+            self.episode_ids[index],
+            self.numbers[index],
+            self.speakers[self.codes[index]],
+            str(self.text[start:end], "utf-8"),
+        )
+
+    def find(self, id: int) -> Optional[int]:
+        by_id = self.by_id
+        index = bisect(len(by_id), lambda i: self.ids[by_id[i]], id)
+        if index < len(by_id) and self.ids[by_id[index]] == id:
+            return by_id[index]
+        return None
+
+    def rows(self, ids: Iterable[int]) -> List[QuoteRow]:
+        rows: List[QuoteRow] = []
+        for id in ids:
+            index = self.find(id)
+            if index is not None:
+                rows.append(self.row(index))
+        return rows
+
+    def choice(self, speaker: Optional[str] = None) -> Optional[QuoteRow]:
+        """A uniformly random row, from one speaker if given"""
+        if not speaker:
+            return self.row(randrange(len(self))) if len(self) else None
+        code = self.speaker_codes.get(speaker, None)
+        if code is None:
+            return None
+        first, last = self.speaker_starts[code], self.speaker_starts[code + 1]
+        if first == last:
+            return None
+        return self.row(self.speaker_rows[randrange(first, last)])
+
+    def position(self, episode_id: int, number: int) -> int:
+        """Index of the first row at or after the given utterance"""
+        return bisect(
+            len(self),
+            lambda i: (self.episode_ids[i], self.numbers[i]),
+            (episode_id, number),
+        )
+
+    def window(self, episode_id: int, start: int, end: int) -> List[QuoteRow]:
+        lo = self.position(episode_id, start)
+        hi = self.position(episode_id, end + 1)
+        return [self.row(index) for index in range(lo, hi)]
+
+    def search(
+        self,
+        speaker: Optional[str],
+        subject: Optional[str],
+        limit: int,
+        reverse: bool = False,
+        random: bool = False,
+        after: Optional[Tuple[int, int]] = None,
+    ) -> List[QuoteRow]:
+        """Quote rows like the SQL search queries, with `LIKE` semantics for subjects"""
+        lo, hi = 0, len(self)
+        if after is not None and reverse:
+            hi = self.position(*after)
+        elif after is not None:
+            lo = self.position(after[0], after[1] + 1)
+
+        matches = self.matches(speaker, subject, lo, hi, reverse)
+        if random:
+            found = list(matches)
+            count = min(limit, len(found)) if limit > 0 else len(found)
+            indexes: Iterable[int] = sample(found, count)
+        elif limit > 0:
+            indexes = islice(matches, limit)
+        else:
+            indexes = matches
+        return [self.row(index) for index in indexes]
+
+    def matches(
+        self,
+        speaker: Optional[str],
+        subject: Optional[str],
+        lo: int,
+        hi: int,
+        reverse: bool = False,
+    ) -> Iterator[int]:
+        """Indices of matching rows between `lo` and `hi`, in order"""
+        code: Optional[int] = None
+        if speaker:
+            code = self.speaker_codes.get(speaker, None)
+            if code is None:
+                return
+
+        if subject:
+            for index in self.find_text(subject, lo, hi, reverse):
+                if code is None or self.codes[index] == code:
+                    yield index
+
+        elif code is not None:
+            indexes = self.speaker_rows
+            first, last = self.speaker_starts[code], self.speaker_starts[code + 1]
+            start = bisect_left(indexes, lo, first, last)
+            end = bisect_left(indexes, hi, start, last)
+            if reverse:
+                yield from (indexes[i] for i in range(end - 1, start - 1, -1))
+            else:
+                yield from (indexes[i] for i in range(start, end))
+
+        else:
+            yield from (range(hi - 1, lo - 1, -1) if reverse else range(lo, hi))
+
+    def find_text(
+        self, subject: str, lo: int, hi: int, reverse: bool = False
+    ) -> Iterator[int]:
+        """Indices of rows between `lo` and `hi` whose text contains `subject`"""
+        offsets, folded = self.offsets, self.folded
+        start, stop = offsets[lo], offsets[hi]
+        pattern = like_pattern(subject)
+
+        if pattern is not None:
+            found: List[int] = []
+            while start < stop:
+                match = pattern.search(folded, start, stop)
+                if match is None:
+                    break
+                index = bisect_right(offsets, match.start()) - 1
+                found.append(index)
+                start = offsets[index + 1]
+            yield from (reversed(found) if reverse else found)
+            return
+
+        needle = subject.encode().lower()
+        if reverse:
+            while True:
+                position = folded.rfind(needle, start, stop)
+                if position < 0:
+                    return
+                index = bisect_right(offsets, position) - 1
+                yield index
+                stop = offsets[index]
+        else:
+            while True:
+                position = folded.find(needle, start, stop)
+                if position < 0:
+                    return
+                index = bisect_right(offsets, position) - 1
+                yield index
+                start = offsets[index + 1]
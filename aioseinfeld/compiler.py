@@ -0,0 +1,126 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT License
+
+"""
+Compile a script database into an optimized, read-only copy.
+
+The compiled file keeps the original tables, and adds a real `quote` table instead of
+the temporary view, covering indexes, a full-text index, and precomputed statistics.
+`Seinfeld` recognizes compiled files by their application id, and uses them as-is.
+"""
+
+import os
+import sqlite3
+from pathlib import Path
+from typing import Union
+
+from .seinfeld import COMPILED_APPLICATION_ID, COMPILED_VERSION, QUOTE_QUERY
+
+# larger pages mean shallower trees, and fewer reads for scans of quote text
+PAGE_SIZE = 16384
+
+TABLES = ("episode", "utterance", "sentence")
+
+INDEXES = """
+    CREATE INDEX utterance_episode ON utterance (episode_id, utterance_number);
+    CREATE INDEX utterance_speaker ON utterance (speaker);
+    CREATE INDEX sentence_utterance ON sentence (utterance_id, sentence_number);
+    CREATE INDEX quote_episode ON quote (episode_id, utterance_number);
+    CREATE INDEX quote_speaker ON quote (speaker, episode_id, utterance_number);
+"""
+
+
+def compile_database(
+    source: Union[str, Path], destination: Union[str, Path], page_size: int = PAGE_SIZE
+) -> Path:
+    """
+    Write a compiled copy of the database at `source` to `destination`.
+
+    The destination must not exist yet, and is only created once compiling succeeds.
+    The page size must be a power of two from 512 to 65536.
+    """
+    source = Path(source)
+    destination = Path(destination)
+    if not (512 <= page_size <= 65536 and page_size & (page_size - 1) == 0):
+        raise ValueError(
+            f"page size must be a power of two from 512 to 65536, got {page_size}"
+        )
+    if not source.is_file():
+        raise ValueError(f"source {str(source)!r} does not exist")
+    if destination.exists():
+        raise ValueError(f"destination {str(destination)!r} already exists")
+
+    tmp_path = destination.with_name(f"{destination.name}.tmp")
+    if tmp_path.exists():
+        tmp_path.unlink()
+
+    db = sqlite3.connect(tmp_path.resolve().as_uri(), uri=True)
+    try:
+        db.execute(f"PRAGMA page_size = {page_size}")
+        db.execute("PRAGMA journal_mode = OFF")
+        db.execute("PRAGMA synchronous = OFF")
+        db.execute(
+            "ATTACH DATABASE ? AS source", [f"{source.resolve().as_uri()}?mode=ro"]
+        )
+
+        # copy the original tables with their original schema
+        for table in TABLES:
+            [(sql,)] = db.execute(
+                "SELECT sql FROM source.sqlite_master WHERE name = ?",
+                [table],
+            ).fetchall()
+            db.execute(sql)
+            db.execute(f"INSERT INTO main.{table} SELECT * FROM source.{table}")
+        db.commit()
+        db.execute("DETACH DATABASE source")
+
+        db.execute(
+            """
+            CREATE TABLE quote (
+                id INTEGER PRIMARY KEY,
+                episode_id INTEGER,
+                utterance_number INTEGER,
+                speaker TEXT,
+                text TEXT
+            )
+            """
+        )
+        db.execute(f"INSERT INTO quote SELECT * FROM ({QUOTE_QUERY})")
+        db.executescript(INDEXES)
+
+        db.execute("CREATE VIRTUAL TABLE quote_fts USING fts5(text, content='')")
+        db.execute("INSERT INTO quote_fts (rowid, text) SELECT id, text FROM quote")
+        db.execute("INSERT INTO quote_fts (quote_fts) VALUES ('optimize')")
+
+        db.execute(
+            """
+            CREATE TABLE speaker_stat (
+                speaker TEXT PRIMARY KEY,
+                utterances INTEGER,
+                quotes INTEGER
+            )
+            """
+        )
+        db.execute(
+            """
+            INSERT INTO speaker_stat
+            SELECT u.speaker, count(*), count(q.id)
+            FROM utterance u LEFT JOIN quote q ON u.id = q.id
+            GROUP BY u.speaker
+            """
+        )
+
+        # planner statistics, so the indexes above are chosen well
+        db.execute("ANALYZE")
+        db.execute(f"PRAGMA application_id = {COMPILED_APPLICATION_ID}")
+        db.execute(f"PRAGMA user_version = {COMPILED_VERSION}")
+        db.commit()
+        db.execute("VACUUM")
+    except BaseException:
+        db.close()
+        tmp_path.unlink()
+        raise
+    db.close()
+
+    os.replace(tmp_path, destination)
+    return destination
@@ -0,0 +1,241 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT License
+
+"""
+Generate synthetic script databases, for offline tests and benchmarks.
+
+The generated file has the same `episode`, `utterance` and `sentence` tables as the
+real `seinfeld.db`, filled with random but reproducible text.
+"""
+
+import argparse
+import datetime as dt
+import random
+import sqlite3
+import string
+from itertools import accumulate
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Set, Tuple, Union
+
+# approximate size of the real database, used as the unit for `scale`
+EPISODES = 180
+UTTERANCES = 300
+
+SPEAKERS = [
+    "JERRY",
+    "GEORGE",
+    "ELAINE",
+    "KRAMER",
+    "NEWMAN",
+    "MORTY",
+    "HELEN",
+    "FRANK",
+    "ESTELLE",
+    "PUDDY",
+    "PETERMAN",
+    "BANIA",
+    "SUSAN",
+    "UNCLE LEO",
+    "MR. PITT",
+]
+
+SCHEMA = """
+    CREATE TABLE episode (
+        id INTEGER PRIMARY KEY,
+        season_number INTEGER,
+        episode_number INTEGER,
+        title TEXT,
+        the_date TEXT,
+        writer TEXT,
+        director TEXT
+    );
+    CREATE TABLE utterance (
+        id INTEGER PRIMARY KEY,
+        episode_id INTEGER,
+        utterance_number INTEGER,
+        speaker TEXT
+    );
+    CREATE TABLE sentence (
+        id INTEGER PRIMARY KEY,
+        utterance_id INTEGER,
+        sentence_number INTEGER,
+        text TEXT
+    );
+"""
+
+
+def zipf_weights(count: int, skew: float) -> List[float]:
+    """Cumulative weights where the nth item is 1/n**skew as likely as the first"""
+    return list(accumulate(1 / (rank**skew) for rank in range(1, count + 1)))
+
+
+def vocabulary(rng: random.Random, size: int) -> List[str]:
+    words: Set[str] = set()
+    while len(words) < size:
+        length = rng.randint(1, 10)
+        words.add("".join(rng.choices(string.ascii_lowercase, k=length)))
+    return sorted(words, key=len)
+
+
+def generate(
+    path: Union[str, Path],
+    episodes: int = EPISODES,
+    utterances: int = UTTERANCES,
+    seasons: int = 9,
+    speakers: Optional[Sequence[str]] = None,
+    speaker_skew: float = 1.0,
+    sentences: Tuple[int, int] = (1, 4),
+    words: Tuple[int, int] = (1, 15),
+    vocabulary_size: int = 5000,
+    vocabulary_skew: float = 1.0,
+    silent: float = 0.01,
+    seed: int = 0,
+) -> Path:
+    """
+    Write a synthetic script database to `path`, which must not exist yet.
+
+    There will be `episodes` episodes spread evenly over `seasons`, with `utterances`
+    utterances each. Speakers and words are drawn from Zipf distributions with the
+    given skew, so a few are very common and most are rare. Each utterance gets a
+    random number of sentences, and each sentence a random number of words, within
+    the given inclusive ranges. A `silent` fraction of utterances have no sentences,
+    like stage directions in the real scripts.
+    """
+    path = Path(path)
+    if path.exists():
+        raise ValueError(f"path {str(path)!r} already exists")
+    if episodes < 1 or utterances < 1 or seasons < 1:
+        raise ValueError("episodes, utterances, and seasons must be positive")
+    if vocabulary_size < 10:
+        raise ValueError(f"vocabulary_size must be at least 10, got {vocabulary_size}")
+
+    rng = random.Random(seed)
+    names = list(speakers or SPEAKERS)
+    speaker_weights = zipf_weights(len(names), speaker_skew)
+    words_list = vocabulary(rng, vocabulary_size)
+    word_weights = zipf_weights(len(words_list), vocabulary_skew)
+    per_season = -(-episodes // seasons)
+
+    def episode_rows() -> Iterator[Tuple[int, int, int, str, str, str, str]]:
+        date = dt.date(1989, 7, 5)
+        for id in range(1, episodes + 1):
+            title = " ".join(rng.choices(words_list, cum_weights=word_weights, k=2))
+            writers = ", ".join(rng.sample(words_list[-100:], rng.randint(1, 2)))
+            yield (
+                id,
+                (id - 1) // per_season + 1,
+                (id - 1) % per_season + 1,
+                f"The {title.title()}",
+                date.isoformat(),
+                writers,
+                rng.choice(words_list[-10:]),
+            )
+            date += dt.timedelta(days=7)
+
+    def utterance_rows() -> Iterator[Tuple[int, int, int, str]]:
+        id = 0
+        for episode_id in range(1, episodes + 1):
+            chosen = rng.choices(names, cum_weights=speaker_weights, k=utterances)
+            for number, speaker in enumerate(chosen, 1):
+                id += 1
+                yield (id, episode_id, number, speaker)
+
+    def sentence_rows() -> Iterator[Tuple[int, int, int, str]]:
+        id = 0
+        for utterance_id in range(1, episodes * utterances + 1):
+            if rng.random() < silent:
+                continue
+            for number in range(1, rng.randint(*sentences) + 1):
+                count = rng.randint(*words)
+                text = " ".join(
+                    rng.choices(words_list, cum_weights=word_weights, k=count)
+                )
+                id += 1
+                yield (id, utterance_id, number, text.capitalize() + rng.choice(".?!"))
+
+    db = sqlite3.connect(str(path))
+    try:
+        db.execute("PRAGMA journal_mode = OFF")
+        db.execute("PRAGMA synchronous = OFF")
+        db.executescript(SCHEMA)
+        db.executemany(
+            "INSERT INTO episode VALUES (?, ?, ?, ?, ?, ?, ?)", episode_rows()
+        )
+        db.executemany("INSERT INTO utterance VALUES (?, ?, ?, ?)", utterance_rows())
+        db.executemany("INSERT INTO sentence VALUES (?, ?, ?, ?)", sentence_rows())
+        db.commit()
+    finally:
+        db.close()
+
+    return path
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m aioseinfeld.corpus",
+        description="Generate a synthetic script database",
+    )
+    parser.add_argument("path", type=Path, help="database file to create")
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="number of episodes, relative to the real database (default 1.0)",
+    )
+    parser.add_argument(
+        "--utterances",
+        type=int,
+        default=UTTERANCES,
+        help=f"utterances per episode (default {UTTERANCES})",
+    )
+    parser.add_argument("--seasons", type=int, default=9, help="(default 9)")
+    parser.add_argument(
+        "--speaker-skew",
+        type=float,
+        default=1.0,
+        help="zipf exponent for speakers, 0 for uniform (default 1.0)",
+    )
+    parser.add_argument(
+        "--sentences",
+        type=int,
+        nargs=2,
+        default=(1, 4),
+        metavar=("MIN", "MAX"),
+        help="sentences per utterance (default 1 4)",
+    )
+    parser.add_argument(
+        "--words",
+        type=int,
+        nargs=2,
+        default=(1, 15),
+        metavar=("MIN", "MAX"),
+        help="words per sentence (default 1 15)",
+    )
+    parser.add_argument(
+        "--vocabulary", type=int, default=5000, help="distinct words (default 5000)"
+    )
+    parser.add_argument(
+        "--vocabulary-skew",
+        type=float,
+        default=1.0,
+        help="zipf exponent for words, 0 for uniform (default 1.0)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="(default 0)")
+    args = parser.parse_args(argv)
+
+    generate(
+        args.path,
+        episodes=max(1, round(EPISODES * args.scale)),
+        utterances=args.utterances,
+        seasons=args.seasons,
+        speaker_skew=args.speaker_skew,
+        sentences=(args.sentences[0], args.sentences[1]),
+        words=(args.words[0], args.words[1]),
+        vocabulary_size=args.vocabulary,
+        vocabulary_skew=args.vocabulary_skew,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT License
+
+"""
+Regular expression search, scanning a snapshot of quote texts with a process pool.
+"""
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from random import sample
+from typing import List, Optional, Pattern, Sequence, Tuple
+
+from .columns import Columns, QuoteRow
+
+# columns mapped from the snapshot file, in each worker process
+COLUMNS: Optional[Columns] = None
+
+# ranges per worker, so that busy workers are balanced, and scans can stop early
+RANGES_PER_WORKER = 4
+
+
+def load(path: str) -> None:
+    global COLUMNS
+    COLUMNS = Columns.open(path)
+
+
+def scan(pattern: Pattern[str], code: Optional[int], lo: int, hi: int) -> List[int]:
+    """Indices of rows between `lo` and `hi` whose text matches `pattern`"""
+    assert COLUMNS is not None, "scan worker has not loaded a snapshot"
+    codes, offsets = COLUMNS.codes, COLUMNS.offsets
+    texts = str(COLUMNS.text[offsets[lo] : offsets[hi]], "utf-8").split("\x00")
+    return [
+        index
+        for index, text in zip(range(lo, hi), texts)
+        if (code is None or codes[index] == code) and pattern.search(text)
+    ]
+
+
+def episode_ranges(episode_ids: Sequence[int], count: int) -> List[Tuple[int, int]]:
+    """Split rows into at most `count` ranges, without splitting any episode"""
+    starts = [
+        index
+        for index in range(len(episode_ids))
+        if index == 0 or episode_ids[index] != episode_ids[index - 1]
+    ]
+    step = max(1, -(-len(starts) // count))
+    bounds = starts[::step] + [len(episode_ids)]
+    return list(zip(bounds, bounds[1:]))
+
+
+class Scanner:
+    """
+    Pool of worker processes that each map the same snapshot file.
+
+    Every search is split into ranges of whole episodes, scanned in parallel, and
+    merged back in episode and utterance order.
+    """
+
+    def __init__(self, columns: Columns, path: Path, workers: int) -> None:
+        self.columns = columns
+        self.ranges = episode_ranges(columns.episode_ids, workers * RANGES_PER_WORKER)
+        # workers load the snapshot by path, so spawn them rather than forking a
+        # process with running connection threads
+        self.pool = ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=load,
+            initargs=(str(path),),
+        )
+
+    async def close(self) -> None:
+        """Stop the worker processes, without blocking the event loop"""
+        await asyncio.get_running_loop().run_in_executor(None, self.pool.shutdown)
+
+    async def search(
+        self,
+        speaker: Optional[str],
+        pattern: Pattern[str],
+        limit: int,
+        reverse: bool = False,
+        random: bool = False,
+    ) -> List[QuoteRow]:
+        code: Optional[int] = None
+        if speaker:
+            code = self.columns.speaker_codes.get(speaker, None)
+            if code is None:
+                return []
+
+        loop = asyncio.get_running_loop()
+        ranges = self.ranges[::-1] if reverse else self.ranges
+        futures = [
+            loop.run_in_executor(self.pool, scan, pattern, code, lo, hi)
+            for lo, hi in ranges
+        ]
+
+        # gather ranges in order, and stop once enough quotes have matched
+        found: List[int] = []
+        try:
+            for future in futures:
+                indexes = await future
+                found.extend(reversed(indexes) if reverse else indexes)
+                if limit > 0 and not random and len(found) >= limit:
+                    break
+        finally:
+            for future in futures:
+                future.cancel()
+
+        if random:
+            found = sample(found, len(found))
+        if limit > 0:
+            found = found[:limit]
+        return [self.columns.row(index) for index in found]
@@ -2,226 +2,1056 @@
 # Licensed under the MIT License
 
 
-from contextlib import AsyncExitStack
-from functools import wraps
+import asyncio
+import binascii
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from array import array
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from bisect import bisect_left, bisect_right
+from contextlib import AsyncExitStack, contextmanager
+from dataclasses import replace
+from functools import lru_cache, partial, wraps
+from itertools import chain
 from pathlib import Path
-from typing import TypeVar, Callable, Awaitable, Optional, Union, Dict, Any, cast, List
+from random import choice
+from tempfile import TemporaryDirectory
+from weakref import WeakValueDictionary
+from typing import (
+    TypeVar,
+    Callable,
+    Awaitable,
+    Optional,
+    Union,
+    Dict,
+    Any,
+    List,
+    Iterable,
+    Iterator,
+    AsyncGenerator,
+    AsyncIterator,
+    Pattern,
+    Tuple,
+)
 
 import aiosqlite
 
+from .columns import Columns
+from .scan import Scanner
+from .suffix import SuffixIndex
 from .types import (
     Speaker,
     Episode,
     Season,
     Quote,
     Passage,
+    Page,
+    QueryEvent,
+    QueryStats,
+    Tuning,
     Speakers,
     Episodes,
     Seasons,
     Name,
 )
 
+LOG = logging.getLogger(__name__)
+
 T = TypeVar("T")
 Coro = Callable[..., Awaitable[T]]
 
 
 def cached(fn: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
-    cache: Optional[T] = None
+    """
+    Memoize an async method on each instance, keyed by its arguments.
+
+    Concurrent callers share a single in-flight call, and failed calls are forgotten
+    so that the next caller tries again. Use `Seinfeld.invalidate()` to clear results.
+    """
+    name = fn.__name__
 
     @wraps(fn)
-    async def wrapper(*args):
-        nonlocal cache
-        if cache is None:
-            cache = await fn(*args)
-        return cache
+    async def wrapper(self, *args):
+        return await single_flight(self._cache, (name, args), partial(fn, self, *args))
 
     return wrapper
 
 
+async def single_flight(
+    cache: Dict[Any, "asyncio.Future[Any]"], key: Any, coro: Callable[[], Awaitable[T]]
+) -> T:
+    """
+    Await the cached call for `key`, or start it with `coro` if there is none.
+
+    Concurrent callers share the in-flight call. A failed call is forgotten, so the
+    next caller tries again.
+    """
+    future = cache.get(key, None)
+    if future is None:
+        future = asyncio.ensure_future(coro())
+        future.add_done_callback(partial(forget_failure, cache, key))
+        cache[key] = future
+    return await asyncio.shield(future)
+
+
+def forget_failure(cache: Dict[Any, "asyncio.Future[Any]"], key: Any, future) -> None:
+    if future.cancelled() or future.exception() is not None:
+        if cache.get(key, None) is future:
+            del cache[key]
+
+
 class CacheLater(Awaitable[T]):
+    """
+    Lazily await a coroutine function the first time this object is awaited.
+
+    Concurrent awaiters share the same in-flight call and result. A failed call is
+    forgotten, so the next awaiter tries again.
+    """
+
     def __init__(self, coro: Coro, **kwargs):
-        self.coro: Optional[Coro] = coro
+        self.coro: Coro = coro
         self.kwargs: Dict[str, Any] = kwargs
-        self.result: Optional[T] = None
+        self.cache: Dict[None, "asyncio.Future[T]"] = {}
 
     def __await__(self):
         return self.fetch().__await__()
 
     async def fetch(self) -> T:
-        if self.coro is not None:
-            self.result = await self.coro(**self.kwargs)
-            self.coro = None
+        return await single_flight(self.cache, None, partial(self.coro, **self.kwargs))
+
+
+# public names for `Seinfeld.invalidate()`, and the cached lookups each one forgets;
+# seasons and episodes refer to each other, so they are always forgotten together
+CACHED_LOOKUPS = {
+    "speakers": ("speakers",),
+    "seasons": ("seasons", "_episode_map"),
+    "episodes": ("seasons", "_episode_map"),
+}
+
+QUOTE_COLUMNS = "id, episode_id, utterance_number, speaker, text"
+
+# stay below SQLite's default limit of 999 bound parameters per statement
+MAX_PARAMS = 900
+
+# marks databases written by `aioseinfeld.compiler`, as `pragma application_id`
+COMPILED_APPLICATION_ID = 0x53454946
+COMPILED_VERSION = 1
+
+QUOTE_QUERY = """
+    SELECT u.id, u.episode_id, u.utterance_number,
+    u.speaker, group_concat(s.text, " ") text
+    FROM utterance u
+    JOIN sentence s ON u.id = s.utterance_id
+    GROUP BY u.id
+    ORDER BY u.episode_id asc, u.utterance_number asc,
+    s.sentence_number asc
+"""
+
+
+def fts_query(subject: str) -> str:
+    """
+    Convert a search subject into an FTS5 query.
+
+    Subjects are matched as a phrase of whole tokens, and a trailing `*` turns the
+    last token into a prefix. Double quotes are escaped, so any subject is valid.
+    """
+    prefix = subject.endswith("*")
+    if prefix:
+        subject = subject[:-1].strip()
+    phrase = '"' + subject.replace('"', '""') + '"'
+    return phrase + "*" if prefix else phrase
+
+
+@contextmanager
+def fts_errors(query: str, subject: Optional[str]) -> Iterator[None]:
+    """Report errors from full-text queries as invalid subjects"""
+    try:
+        yield
+    except sqlite3.OperationalError as e:
+        if "quote_fts" not in query:
+            raise
+        raise ValueError(f"invalid subject {subject!r}: {e}") from e
+
+
+def source_stamp(path: Path) -> str:
+    """
+    Identify one version of a database file, by its size and modification time.
+
+    Indexes stored next to the database record this, so that they are ignored once
+    the database file is replaced.
+    """
+    stat = path.stat()
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+@lru_cache(maxsize=256)
+def query_shape(query: str) -> str:
+    """
+    Normalize a query for grouping in stats, ignoring whitespace and repetition.
+
+    Lists of parameters like `in (?, ?, ?)`, and runs of identical `or` clauses, are
+    collapsed so that queries differing only in the number of values look the same.
+    """
+    shape = " ".join(query.split())
+    shape = re.sub(r"\?(?:, \?)+", "?, ...", shape)
+    shape = re.sub(r"(\([^()]*\))(?: or \1)+", r"\1 or ...", shape)
+    return shape
+
+
+@lru_cache(maxsize=None)
+def search_sql(
+    speaker: bool, match: Optional[str], after: bool, order: str, columns: str
+) -> str:
+    """
+    Build the SQL for one shape of search query.
 
-        return cast(T, self.result)
+    There are only a few dozen shapes, so each is built once and then reused, and
+    the identical strings always hit the statement cache of each connection. A
+    negative limit means no limit in SQLite, so every shape takes a limit parameter.
+    """
+    wheres = []
+    if speaker:
+        wheres.append("speaker = ?")
+    if match == "fts":
+        wheres.append("id in (select rowid from quote_fts where quote_fts match ?)")
+    elif match == "like":
+        wheres.append("text like ?")
+    elif match == "ids":
+        # candidates from the substring index, which `like` then confirms
+        wheres.append("id in (select value from json_each(?))")
+        wheres.append("text like ?")
+    if after:
+        op = "<" if order == "desc" else ">"
+        wheres.append(f"(episode_id, utterance_number) {op} (?, ?)")
+
+    query = f"select {columns} from quote"
+    if wheres:
+        query += " where " + " and ".join(wheres)
+    if order == "random":
+        query += " order by RANDOM()"
+    else:
+        query += f" order by episode_id {order}, utterance_number {order}"
+    return query + " limit ?"
+
+
+def page_token(quote: Quote) -> str:
+    key = f"{quote.episode.id}:{quote.number}"
+    return urlsafe_b64encode(key.encode()).decode()
+
+
+def page_key(token: str) -> Tuple[int, int]:
+    try:
+        episode_id, number = urlsafe_b64decode(token.encode()).decode().split(":")
+        return int(episode_id), int(number)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError(f"invalid page token {token!r}")
 
 
 class Seinfeld:
-    def __init__(self, db_path: Union[str, Path]):
+    def __init__(
+        self,
+        db_path: Union[str, Path],
+        materialize: bool = False,
+        pool_size: int = 1,
+        in_memory: bool = False,
+        instrument: bool = False,
+        on_query: Optional[Callable[[QueryEvent], None]] = None,
+        tuning: Union[bool, Tuning, None] = None,
+        engine: str = "sqlite",
+        snapshot: Union[str, Path, None] = None,
+        scan_workers: Optional[int] = None,
+    ):
         self.db: aiosqlite.Connection
         self.db_path: Path = Path(db_path)
         if not self.db_path.is_file():
             raise ValueError(f"db_path {db_path!r} does not exist")
+        if pool_size < 1:
+            raise ValueError(f"pool_size must be at least 1, got {pool_size!r}")
+        if engine not in ("sqlite", "columnar"):
+            raise ValueError(f"engine must be 'sqlite' or 'columnar', got {engine!r}")
+        if scan_workers is not None and scan_workers < 1:
+            raise ValueError(f"scan_workers must be at least 1, got {scan_workers!r}")
+        self.snapshot_path: Optional[Path] = None
+        if snapshot is not None:
+            self.snapshot_path = Path(snapshot)
+            if not self.snapshot_path.is_file():
+                raise ValueError(f"snapshot {snapshot!r} does not exist")
+            # snapshots are always searched in-process
+            engine = "columnar"
 
+        self.materialize = materialize
+        self.pool_size = pool_size
+        self.in_memory = in_memory
+        self.engine = engine
+        self.columns: Optional[Columns] = None
+        self.scan_workers = scan_workers
+        self.scanner: Optional[Scanner] = None
+        self.tuning: Optional[Tuning] = Tuning() if tuning is True else tuning or None
+        self.load_time: Optional[float] = None
+        self.load_size: Optional[int] = None
+        self.pool: "asyncio.Queue[aiosqlite.Connection]"
+        self.uri: str
+        self.fts_path: Path = self.db_path.with_name(f"{self.db_path.name}.fts")
+        self.fts = False
+        self.suffix_path: Path = self.db_path.with_name(f"{self.db_path.name}.sa")
+        self.suffixes: Optional[SuffixIndex] = None
+        self.compiled = False
+        self.on_query = on_query
+        self._stats: Optional[
+            Tuple[Dict[str, QueryStats], Dict[str, QueryStats]]
+        ] = None
+        if instrument or on_query is not None:
+            self._stats = ({}, {})
+        self._started: Dict[aiosqlite.Connection, float] = {}
+        self._unknown_speakers: "WeakValueDictionary[str, Speaker]" = (
+            WeakValueDictionary()
+        )
+        self._cache: Dict[Tuple[str, Tuple[Any, ...]], "asyncio.Future[Any]"] = {}
         self.stack = AsyncExitStack()
 
     async def __aenter__(self) -> "Seinfeld":
-        self.db = await self.stack.enter_async_context(aiosqlite.connect(self.db_path))
-        self.db.row_factory = aiosqlite.Row
+        try:
+            await self._open()
+        except BaseException:
+            # close whatever was opened, since __aexit__ won't be called
+            await self.stack.aclose()
+            raise
+        return self
 
-        await self.db.execute(
-            """
-            CREATE TEMPORARY VIEW IF NOT EXISTS quote AS
-            SELECT u.id, u.episode_id, u.utterance_number,
-            u.speaker, group_concat(s.text, " ") text
-            FROM utterance u
-            JOIN sentence s ON u.id = s.utterance_id
-            GROUP BY u.id
-            ORDER BY u.episode_id asc, u.utterance_number asc,
-            s.sentence_number asc
-        """
-        )
+    async def _open(self) -> None:
+        self.fts = self.fts_path.is_file() and await self._fts_matches()
+        self.pool = asyncio.Queue()
+        self._scanner_lock = asyncio.Lock()
 
-        return self
+        if self.in_memory:
+            # every pooled connection shares one in-memory copy of the database
+            self.uri = f"file:aioseinfeld-{id(self):x}?mode=memory&cache=shared"
+            await self._load(self.uri)
+            self.db = await self._connect(self.uri, uri=True)
+        else:
+            self.uri = f"{self.db_path.resolve().as_uri()}?mode=ro"
+            if self.tuning is None:
+                self.db = await self._connect(self.db_path)
+            else:
+                if self.tuning.immutable:
+                    # promise SQLite the file never changes, so it skips locking
+                    self.uri += "&immutable=1"
+                self.db = await self._connect(self.uri, uri=True)
+
+        self.pool.put_nowait(self.db)
+        for _ in range(self.pool_size - 1):
+            self.pool.put_nowait(await self._connect(self.uri, uri=True))
+
+        if self.engine == "columnar":
+            await self._load_columns()
+        if self.suffix_path.is_file():
+            self._open_suffixes()
+
+    async def _fts_matches(self) -> bool:
+        """Check that the full-text index was built from this version of the database"""
+        uri = f"{self.fts_path.resolve().as_uri()}?mode=ro"
+        async with aiosqlite.connect(uri, uri=True) as db:
+            try:
+                rows = await self._execute(
+                    db, "open", "select stamp from quote_fts_source"
+                )
+            except sqlite3.OperationalError:
+                rows = []
+        if [tuple(row) for row in rows] != [(source_stamp(self.db_path),)]:
+            LOG.warning(
+                "ignoring full-text index %s, built from another version of %s",
+                self.fts_path,
+                self.db_path,
+            )
+            return False
+        return True
+
+    def _open_suffixes(self) -> None:
+        """Open the substring index, unless it was built from another database"""
+        try:
+            suffixes = SuffixIndex.open(self.suffix_path)
+        except ValueError:
+            LOG.warning("ignoring incompatible substring index %s", self.suffix_path)
+            return
+        if suffixes.source != source_stamp(self.db_path):
+            suffixes.close()
+            LOG.warning(
+                "ignoring substring index %s, built from another version of %s",
+                self.suffix_path,
+                self.db_path,
+            )
+            return
+        self.suffixes = suffixes
+        self.stack.callback(suffixes.close)
 
     async def __aexit__(self, *args) -> None:
         await self.stack.aclose()
 
+    def _trace(self, db: aiosqlite.Connection, statement: str) -> None:
+        self._started[db] = time.perf_counter()
+
+    async def _load(self, uri: str) -> None:
+        """
+        Copy the database file into memory using the SQLite backup API.
+
+        The target connection stays open until exit, keeping the copy alive.
+        """
+        before = time.monotonic()
+        target = await self.stack.enter_async_context(aiosqlite.connect(uri, uri=True))
+        async with aiosqlite.connect(self.db_path) as source:
+            await source.backup(target)
+
+        [(size,)] = await self._execute(
+            target,
+            "open",
+            "select page_count * page_size from pragma_page_count, pragma_page_size",
+        )
+
+        self.load_time = time.monotonic() - before
+        self.load_size = size
+        LOG.info(
+            "loaded %s into memory: %d bytes in %.3f seconds",
+            self.db_path,
+            self.load_size,
+            self.load_time,
+        )
+
+    async def _load_columns(self) -> None:
+        """
+        Read every quote once, into columns that are then searched in-process.
+
+        Lookups and searches skip the trip through the connection's worker thread,
+        except subjects when the full-text index exists, which still use SQL.
+        """
+        before = time.monotonic()
+        if self.snapshot_path is not None:
+            self.columns = Columns.open(self.snapshot_path)
+            self.stack.callback(self.columns.close)
+        else:
+            self.columns = await self._build_columns("open")
+        LOG.info(
+            "loaded %d quotes into columns in %.3f seconds",
+            len(self.columns),
+            time.monotonic() - before,
+        )
+
+    async def _build_columns(self, method: str) -> Columns:
+        rows = await self._fetchall(
+            method,
+            f"""
+            select {QUOTE_COLUMNS} from quote
+            order by episode_id asc, utterance_number asc
+            """,
+        )
+        return Columns.from_rows(rows)
+
+    async def snapshot(self, path: Union[str, Path]) -> Path:
+        """
+        Write every quote to a snapshot file, for `Seinfeld(db_path, snapshot=path)`.
+
+        The snapshot is a flat file of columns that is memory-mapped read-only when
+        opened, so many processes can share one copy of it through the page cache.
+        It is not updated when the database changes; write a new one instead.
+        """
+        path = Path(path)
+        columns = self.columns
+        if columns is None:
+            columns = await self._build_columns("snapshot")
+        await asyncio.get_running_loop().run_in_executor(None, columns.save, path)
+        return path
+
+    async def _connect(
+        self, database: Union[str, Path], **kwargs: Any
+    ) -> aiosqlite.Connection:
+        db = await self.stack.enter_async_context(aiosqlite.connect(database, **kwargs))
+        return await self._prepare(db)
+
+    async def _prepare(self, db: aiosqlite.Connection) -> aiosqlite.Connection:
+        """Apply tuning, and create the quote view or table, on a new connection"""
+        db.row_factory = aiosqlite.Row
+        if self._stats is not None:
+            await db.set_trace_callback(partial(self._trace, db))
+
+        tuning = self.tuning
+        if tuning is not None:
+            for pragma in ("mmap_size", "cache_size", "temp_store"):
+                value = getattr(tuning, pragma)
+                if value is not None:
+                    await self._execute(db, "open", f"PRAGMA {pragma} = {value}")
+
+        [(application_id, version)] = await self._execute(
+            db,
+            "open",
+            "select * from pragma_application_id, pragma_user_version",
+        )
+        if application_id == COMPILED_APPLICATION_ID:
+            if version > COMPILED_VERSION:
+                raise ValueError(f"compiled database version {version} not supported")
+            # the quote table and full-text index are already in the database
+            self.compiled = True
+            self.fts = True
+
+        elif self.materialize:
+            # build the quote rows once, so lookups become index seeks
+            await self._execute(
+                db, "open", f"CREATE TEMPORARY TABLE quote AS {QUOTE_QUERY}"
+            )
+            await self._execute(
+                db, "open", "CREATE UNIQUE INDEX temp.quote_id ON quote (id)"
+            )
+            await self._execute(
+                db,
+                "open",
+                """
+                CREATE INDEX temp.quote_episode
+                ON quote (episode_id, utterance_number)
+                """,
+            )
+        else:
+            await self._execute(
+                db,
+                "open",
+                f"CREATE TEMPORARY VIEW IF NOT EXISTS quote AS {QUOTE_QUERY}",
+            )
+
+        if self.fts and not self.compiled:
+            await self._execute(
+                db, "open", "ATTACH DATABASE ? AS fts", [str(self.fts_path)]
+            )
+
+        # last, because query_only also forbids creating temporary tables and views
+        if tuning is not None and tuning.query_only:
+            await self._execute(db, "open", "PRAGMA query_only = 1")
+
+        return db
+
+    async def _fetchall(
+        self, method: str, query: str, params: Iterable[Any] = ()
+    ) -> List[aiosqlite.Row]:
+        submitted = time.perf_counter()
+        db = await self.pool.get()
+        try:
+            return await self._execute(db, method, query, params, submitted)
+        finally:
+            self.pool.put_nowait(db)
+
+    async def _fetchone(
+        self, method: str, query: str, params: Iterable[Any] = ()
+    ) -> Optional[aiosqlite.Row]:
+        rows = await self._fetchall(method, query, params)
+        return rows[0] if rows else None
+
+    async def _execute(
+        self,
+        db: aiosqlite.Connection,
+        method: str,
+        query: str,
+        params: Iterable[Any] = (),
+        submitted: Optional[float] = None,
+    ) -> List[aiosqlite.Row]:
+        if self._stats is None:
+            async with db.execute(query, params) as cursor:
+                return list(await cursor.fetchall())
+
+        before = time.perf_counter()
+        if submitted is None:
+            submitted = before
+        self._started.pop(db, None)
+        async with db.execute(query, params) as cursor:
+            rows = list(await cursor.fetchall())
+        self._record(db, method, query, len(rows), submitted, before)
+        return rows
+
+    async def _stream(
+        self, method: str, query: str, params: Iterable[Any], batch_size: int
+    ) -> AsyncGenerator[List[aiosqlite.Row], None]:
+        """
+        Yield the rows of one query `batch_size` at a time, from a single cursor.
+
+        The cursor is on a dedicated connection that is opened for this query, and
+        closed once every row is read or the generator closes, so pooled connections
+        stay free for other queries between batches.
+        """
+        async with aiosqlite.connect(self.uri, uri=True) as db:
+            await self._prepare(db)
+            submitted = before = time.perf_counter()
+            self._started.pop(db, None)
+            count = 0
+            async with db.execute(query, params) as cursor:
+                while True:
+                    rows = list(await cursor.fetchmany(batch_size))
+                    if not rows:
+                        break
+                    count += len(rows)
+                    yield rows
+            if self._stats is not None:
+                self._record(db, method, query, count, submitted, before)
+            self._started.pop(db, None)
+
+    def _record(
+        self,
+        db: aiosqlite.Connection,
+        method: str,
+        query: str,
+        rows: int,
+        submitted: float,
+        before: float,
+    ) -> None:
+        assert self._stats is not None
+        after = time.perf_counter()
+
+        # the trace callback records when the worker thread started the statement
+        started = self._started.get(db, before)
+        event = QueryEvent(
+            method=method,
+            query=query_shape(query),
+            rows=rows,
+            time=after - submitted,
+            queued=max(0.0, started - submitted),
+        )
+        for key, totals in ((method, self._stats[0]), (event.query, self._stats[1])):
+            stats = totals.get(key, None)
+            if stats is None:
+                stats = totals[key] = QueryStats(0, 0, 0.0, 0.0)
+            stats.calls += 1
+            stats.rows += event.rows
+            stats.time += event.time
+            stats.queued += event.queued
+        if self.on_query is not None:
+            self.on_query(event)
+
+    def stats(self, reset: bool = False) -> Dict[str, Dict[str, QueryStats]]:
+        """
+        Get a snapshot of query totals, by method name and by query shape.
+
+        Only available when created with `instrument=True` or an `on_query` callback.
+        Pass `reset=True` to start counting again from zero.
+        """
+        if self._stats is None:
+            raise RuntimeError("instrumentation is not enabled")
+
+        by_method, by_query = self._stats
+        snapshot = {
+            "methods": {key: replace(value) for key, value in by_method.items()},
+            "queries": {key: replace(value) for key, value in by_query.items()},
+        }
+        if reset:
+            by_method.clear()
+            by_query.clear()
+        return snapshot
+
+    def invalidate(self, *names: str) -> None:
+        """
+        Forget cached lookups, so that they are queried again on next use.
+
+        Pass `"speakers"`, `"seasons"`, or `"episodes"` to only forget those, or
+        nothing to forget every cached lookup. Seasons and episodes are always
+        forgotten together, so every episode still shares one `Season` per season,
+        and every season's episodes are the same objects as `episode()` returns.
+        """
+        for name in names:
+            if name not in CACHED_LOOKUPS:
+                raise ValueError(f"unknown cached lookup {name!r}")
+        names = tuple(chain.from_iterable(CACHED_LOOKUPS[name] for name in names))
+        for key in list(self._cache):
+            if not names or key[0] in names:
+                del self._cache[key]
+        if not names or "speakers" in names:
+            self._unknown_speakers.clear()
+
+    async def build_index(self) -> None:
+        """
+        Build the full-text search index next to the database file.
+
+        Once the index exists, `search()` and `random()` use it to match subjects,
+        both for this instance and for any future instances opened on the same file.
+        """
+        if self.fts:
+            return
+
+        tmp_path = self.fts_path.with_name(f"{self.fts_path.name}.tmp")
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+        # pooled connections may be read-only, so build with a separate connection
+        async with aiosqlite.connect(tmp_path.resolve().as_uri(), uri=True) as db:
+            await self._execute(
+                db, "build_index", "ATTACH DATABASE ? AS source", [self.uri]
+            )
+            await self._execute(
+                db,
+                "build_index",
+                "CREATE VIRTUAL TABLE quote_fts USING fts5(text, content='')",
+            )
+            await self._execute(
+                db,
+                "build_index",
+                f"""
+                INSERT INTO quote_fts (rowid, text)
+                SELECT id, text FROM ({QUOTE_QUERY})
+                """,
+            )
+            await self._execute(
+                db, "build_index", "CREATE TABLE quote_fts_source (stamp TEXT)"
+            )
+            await self._execute(
+                db,
+                "build_index",
+                "INSERT INTO quote_fts_source VALUES (?)",
+                [source_stamp(self.db_path)],
+            )
+            await db.commit()
+
+        # wait for every pooled connection, so none is mid-query while attaching
+        conns = [await self.pool.get() for _ in range(self.pool_size)]
+        try:
+            os.replace(tmp_path, self.fts_path)
+            for db in conns:
+                await self._execute(
+                    db, "build_index", "ATTACH DATABASE ? AS fts", [str(self.fts_path)]
+                )
+            self.fts = True
+
+        finally:
+            for db in conns:
+                self.pool.put_nowait(db)
+
+    async def build_substring_index(self) -> None:
+        """
+        Build the substring index next to the database file.
+
+        Once the index exists, `search()` and `random()` use it to find subjects
+        instead of scanning every quote, with the same results as a `LIKE` scan, both
+        for this instance and for any future instances opened on the same file.
+        Plain subjects use it even when the full-text index also exists.
+        """
+        if self.suffixes is not None:
+            return
+
+        rows = await self._fetchall(
+            "build_substring_index", "select id, text from quote order by id"
+        )
+        loop = asyncio.get_running_loop()
+        source = source_stamp(self.db_path)
+        index = await loop.run_in_executor(None, SuffixIndex.from_rows, rows, source)
+        await loop.run_in_executor(None, index.save, self.suffix_path)
+        self._open_suffixes()
+
+    async def _scanner(self) -> Scanner:
+        """
+        Start the worker processes for pattern searches, on first use.
+
+        Workers map the instance's snapshot file, or a temporary snapshot written for
+        them, so the quote text is shared through the page cache rather than copied.
+        """
+        async with self._scanner_lock:
+            if self.scanner is not None:
+                return self.scanner
+
+            path = self.snapshot_path
+            if path is None:
+                tmp = self.stack.enter_context(TemporaryDirectory(prefix="aioseinfeld"))
+                path = await self.snapshot(Path(tmp) / "scan.snapshot")
+            columns = self.columns
+            if columns is None:
+                columns = Columns.open(path)
+                self.stack.callback(columns.close)
+
+            workers = self.scan_workers or os.cpu_count() or 1
+            self.scanner = Scanner(columns, path, workers)
+            self.stack.push_async_callback(self.scanner.close)
+            return self.scanner
+
     @cached
     async def speakers(self) -> Speakers:
-        async with self.db.execute("select distinct speaker from utterance") as cursor:
-            ids = [row["speaker"] async for row in cursor]
-            return {id.casefold(): Speaker(id, Name(id.capitalize())) for id in ids}
+        query = "select distinct speaker from utterance"
+        if self.compiled:
+            query = "select speaker from speaker_stat"
+        rows = await self._fetchall("speakers", query)
+        ids = [row["speaker"] for row in rows]
+        return {id.casefold(): Speaker(id, Name(id.capitalize())) for id in ids}
 
     async def speaker(self, name: str) -> Speaker:
-        spkr = (await self.speakers()).get(name.casefold(), None)
+        return self._speaker(name, await self.speakers())
+
+    def _speaker(self, name: str, speakers: Speakers) -> Speaker:
+        spkr = speakers.get(name.casefold(), None)
         if spkr is None:
-            return Speaker(name, Name(name.capitalize()))
+            # intern unknown speakers too, so equal speakers are the same object, but
+            # only while something else still refers to them
+            spkr = self._unknown_speakers.get(name, None)
+            if spkr is None:
+                spkr = Speaker(name, Name(name.capitalize()))
+                self._unknown_speakers[name] = spkr
         return spkr
 
     @cached
     async def seasons(self) -> Seasons:
-        async with self.db.execute(
-            "select distinct season_number from episode order by season_number asc"
-        ) as cursor:
-            return {
-                row["season_number"]: Season(
-                    number=row["season_number"],
-                    episodes=CacheLater(
-                        self.episodes, season_number=row["season_number"]
-                    ),
-                )
-                async for row in cursor
-            }
+        rows = await self._fetchall(
+            "seasons",
+            "select distinct season_number from episode order by season_number asc",
+        )
+        return {
+            row["season_number"]: Season(
+                number=row["season_number"],
+                episodes=CacheLater(self.episodes, season_number=row["season_number"]),
+            )
+            for row in rows
+        }
 
     async def season(self, number: int) -> Optional[Season]:
         return (await self.seasons()).get(number, None)
 
-    async def episodes(self, season_number: Optional[int] = None) -> Episodes:
-        where = ""
-        params = []
-        if season_number:
-            where = "where season_number = ?"
-            params = [season_number]
-
-        async with self.db.execute(
-            f"""
+    @cached
+    async def _episode_map(self) -> Dict[int, Episode]:
+        seasons = await self.seasons()
+        episodes: Dict[int, Episode] = {}
+        rows = await self._fetchall(
+            "episode_map",
+            """
             select id, season_number, episode_number, title, the_date, writer, director
             from episode
-            {where}
             order by season_number asc, episode_number asc
             """,
-            params,
-        ) as cursor:
-            return [
-                Episode(
-                    id=row["id"],
-                    season=Season(
-                        row["season_number"],
-                        CacheLater(self.episodes, season_number=row["season_number"]),
-                    ),
-                    number=row["episode_number"],
-                    title=row["title"],
-                    date=row["the_date"],
-                    writers=[w.strip().capitalize() for w in row["writer"].split(",")],
-                    director=row["director"].capitalize(),
-                )
-                async for row in cursor
-            ]
+        )
+        for row in rows:
+            episodes[row["id"]] = Episode(
+                id=row["id"],
+                season=seasons[row["season_number"]],
+                number=row["episode_number"],
+                title=row["title"],
+                date=row["the_date"],
+                writers=[w.strip().capitalize() for w in row["writer"].split(",")],
+                director=row["director"].capitalize(),
+            )
+        return episodes
+
+    async def episodes(self, season_number: Optional[int] = None) -> Episodes:
+        episodes = (await self._episode_map()).values()
+        if season_number:
+            return [e for e in episodes if e.season.number == season_number]
+        return list(episodes)
 
     async def episode(self, id: int) -> Optional[Episode]:
-        async with self.db.execute(
-            """
-            select id, season_number, episode_number, title, the_date, writer, director
-            from episode
-            where id = ?
-            """,
-            [id],
-        ) as cursor:
-            row = await cursor.fetchone()
-            if row is not None:
-                return Episode(
-                    id=row["id"],
-                    season=Season(
-                        row["season_number"],
-                        CacheLater(self.episodes, season_number=row["season_number"]),
-                    ),
-                    number=row["episode_number"],
-                    title=row["title"],
-                    date=row["the_date"],
-                    writers=[w.strip().capitalize() for w in row["writer"].split(",")],
-                    director=row["director"].capitalize(),
+        return (await self._episode_map()).get(id, None)
+
+    def _quotes(
+        self,
+        rows: Iterable[Any],
+        episodes: Dict[int, Episode],
+        speakers: Speakers,
+    ) -> List[Quote]:
+        """Build quotes from database rows or column rows, both in `QUOTE_COLUMNS`"""
+        quotes: List[Quote] = []
+        for id, episode_id, number, speaker, text in rows:
+            episode = episodes.get(episode_id, None)
+            if episode is None:
+                raise ValueError(f"episode_id {episode_id} not found")
+            quotes.append(
+                Quote(
+                    id=id,
+                    episode=episode,
+                    number=number,
+                    speaker=self._speaker(speaker, speakers),
+                    text=text,
                 )
-            return None
+            )
+        return quotes
 
     async def quote(self, id: int) -> Optional[Quote]:
-        async with self.db.execute(
-            """
-            select id, episode_id, utterance_number, speaker, text
-            from quote
-            where id = ?
-            """,
-            [id],
-        ) as cursor:
-            row = await cursor.fetchone()
-            if row is not None:
-                episode = await self.episode(row["episode_id"])
-                if episode is None:
-                    raise ValueError(f"episode_id {row['episode_id']} not found")
-                return Quote(
-                    id=row["id"],
-                    episode=episode,
-                    number=row["utterance_number"],
-                    speaker=await self.speaker(row["speaker"]),
-                    text=row["text"],
+        episodes = await self._episode_map()
+        speakers = await self.speakers()
+        if self.columns is not None:
+            rows: List[Any] = self.columns.rows([id])
+            row = rows[0] if rows else None
+        else:
+            row = await self._fetchone(
+                "quote",
+                f"select {QUOTE_COLUMNS} from quote where id = ?",
+                [id],
+            )
+        if row is not None:
+            return self._quotes([row], episodes, speakers)[0]
+        return None
+
+    async def quotes(self, ids: Iterable[int]) -> Dict[int, Quote]:
+        """
+        Get many quotes by id, in as few queries as possible.
+
+        The result is ordered like `ids`, and leaves out ids that were not found.
+        """
+        episodes = await self._episode_map()
+        speakers = await self.speakers()
+        unique = list(dict.fromkeys(ids))
+
+        found: Dict[int, Quote] = {}
+
+        for start in range(0, len(unique), MAX_PARAMS):
+            chunk = unique[start : start + MAX_PARAMS]
+            rows: List[Any]
+            if self.columns is not None:
+                rows = self.columns.rows(chunk)
+            else:
+                marks = ", ".join("?" for _ in chunk)
+                rows = await self._fetchall(
+                    "quotes",
+                    f"""
+                    select id, episode_id, utterance_number, speaker, text
+                    from quote
+                    where id in ({marks})
+                    """,
+                    chunk,
                 )
-            return None
+            for quote in self._quotes(rows, episodes, speakers):
+                found[quote.id] = quote
+
+        return {id: found[id] for id in unique if id in found}
 
     async def passage(self, quote: Quote, length: int = 5) -> Passage:
-        half = length // 2
-        middle = quote.number
-        start = middle - half if middle > half else 1
-        end = start + length - 1
+        return (await self.passages([quote], length))[0]
 
-        query = """
-            select id, episode_id, utterance_number, speaker, text
-            from quote
-            where episode_id = ? and
-                utterance_number >= ? and utterance_number <= ?
-            order by utterance_number
+    async def passages(self, quotes: Iterable[Quote], length: int = 5) -> List[Passage]:
         """
+        Get the passage around each of the given quotes, like `passage()`.
 
-        async with self.db.execute(query, (quote.episode.id, start, end)) as cursor:
-            quotes = [
-                Quote(
-                    id=row["id"],
-                    episode=quote.episode,
-                    number=row["utterance_number"],
-                    speaker=await self.speaker(row["speaker"]),
-                    text=row["text"],
+        Windows from the same episode are merged, and all of them are fetched together
+        before being split back into one passage per quote, in the order given.
+        """
+        seeds = list(quotes)
+        half = length // 2
+        windows: Dict[int, List[Tuple[int, int]]] = {}
+        for seed in seeds:
+            middle = seed.number
+            start = middle - half if middle > half else 1
+            windows.setdefault(seed.episode.id, []).append((start, start + length - 1))
+
+        # merge overlapping windows, so that each row is only fetched once
+        ranges: List[Tuple[int, int, int]] = []
+        for episode_id, spans in sorted(windows.items()):
+            spans = sorted(spans)
+            start, end = spans[0]
+            for next_start, next_end in spans[1:]:
+                if next_start > end + 1:
+                    ranges.append((episode_id, start, end))
+                    start = next_start
+                end = max(end, next_end)
+            ranges.append((episode_id, start, end))
+
+        episodes = {seed.episode.id: seed.episode for seed in reversed(seeds)}
+        speakers = await self.speakers()
+        found: Dict[int, List[Quote]] = {}
+        step = MAX_PARAMS // 3
+        for index in range(0, len(ranges), step):
+            chunk = ranges[index : index + step]
+            rows: List[Any]
+            if self.columns is not None:
+                rows = [row for span in chunk for row in self.columns.window(*span)]
+            else:
+                wheres = " or ".join(
+                    "(episode_id = ? and utterance_number between ? and ?)"
+                    for _ in chunk
+                )
+                rows = await self._fetchall(
+                    "passages",
+                    f"""
+                    select id, episode_id, utterance_number, speaker, text
+                    from quote
+                    where {wheres}
+                    order by episode_id, utterance_number
+                    """,
+                    [value for span in chunk for value in span],
                 )
-                async for row in cursor
-            ]
-            return Passage(quote.id, quote.episode, quotes)
+            for quote in self._quotes(rows, episodes, speakers):
+                found.setdefault(quote.episode.id, []).append(quote)
+
+        numbers = {
+            episode_id: [quote.number for quote in candidates]
+            for episode_id, candidates in found.items()
+        }
+        passages: List[Passage] = []
+        for seed in seeds:
+            middle = seed.number
+            start = middle - half if middle > half else 1
+            end = start + length - 1
+            candidates = found.get(seed.episode.id, [])
+            lo = bisect_left(numbers.get(seed.episode.id, []), start)
+            hi = bisect_right(numbers.get(seed.episode.id, []), end)
+            passages.append(Passage(seed.id, seed.episode, candidates[lo:hi]))
+        return passages
+
+    def _speaker_id(
+        self, speaker: Union[Speaker, str, None], speakers: Speakers
+    ) -> Optional[str]:
+        if not speaker:
+            return None
+        if isinstance(speaker, Speaker):
+            return speaker.id
+        return self._speaker(speaker, speakers).id
+
+    def _search_query(
+        self,
+        speaker: Optional[str],
+        subject: Optional[str],
+        limit: int,
+        reverse: bool = False,
+        random: bool = False,
+        after: Optional[Tuple[int, int]] = None,
+        columns: str = QUOTE_COLUMNS,
+    ) -> Tuple[str, List[Any]]:
+        match: Optional[str] = None
+        ids: Optional[List[int]] = None
+        if (
+            subject
+            and self.suffixes is not None
+            and not (self.fts and subject.endswith("*"))
+        ):
+            # each matching suffix costs about as much as scanning four quotes, so
+            # past as many suffixes as a quarter of all quotes, scan them instead
+            ids = self.suffixes.find(subject, limit=len(self.suffixes) // 4)
+            match = "like" if ids is None else "ids"
+        elif subject:
+            match = "fts" if self.fts else "like"
+        order = "random" if random else "desc" if reverse else "asc"
+        query = search_sql(bool(speaker), match, after is not None, order, columns)
+
+        params: List[Any] = []
+        if speaker:
+            params.append(speaker)
+        if subject and match == "fts":
+            params.append(fts_query(subject))
+        elif subject:
+            if match == "ids":
+                params.append(json.dumps(ids))
+            params.append(f"%{subject}%")
+        if after is not None:
+            params.extend(after)
+        params.append(limit if limit > 0 else -1)
+
+        return query, params
+
+    async def _search_rows(
+        self,
+        method: str,
+        speaker: Optional[str],
+        subject: Optional[str],
+        limit: int,
+        reverse: bool = False,
+        random: bool = False,
+        after: Optional[Tuple[int, int]] = None,
+        columns: str = QUOTE_COLUMNS,
+    ) -> List[Any]:
+        if self.columns is not None and not (subject and self.fts):
+            return self.columns.search(speaker, subject, limit, reverse, random, after)
+
+        query, params = self._search_query(
+            speaker, subject, limit, reverse, random, after, columns
+        )
+        with fts_errors(query, subject):
+            return await self._fetchall(method, query, params)
 
     async def search(
         self,
@@ -230,66 +1060,180 @@ class Seinfeld:
         limit: int = 10,
         reverse: bool = False,
         random: bool = False,
+        pattern: Union[str, Pattern[str], None] = None,
     ) -> List[Quote]:
-        query = """
-            select id, episode_id, utterance_number, speaker, text
-            from quote
         """
+        Find quotes by speaker, and by subject or regular expression `pattern`.
 
-        wheres = []
-        params: List[Any] = []
+        Patterns are matched with `re.search()` against each quote's text, by a pool of
+        worker processes that each scan whole episodes, and can't be combined with a
+        subject. Results are in the same order as any other search.
+        """
+        episodes = await self._episode_map()
+        speakers = await self.speakers()
+        speaker_id = self._speaker_id(speaker, speakers)
+        if pattern is not None:
+            if subject:
+                raise ValueError("pattern can't be combined with subject")
+            scanner = await self._scanner()
+            rows: List[Any] = await scanner.search(
+                speaker_id, re.compile(pattern), limit, reverse, random
+            )
+        else:
+            rows = await self._search_rows(
+                "search", speaker_id, subject, limit, reverse, random
+            )
+        return self._quotes(rows, episodes, speakers)
 
-        if speaker:
-            wheres.append("speaker = ?")
-            if isinstance(speaker, Speaker):
-                params.append(speaker.id)
-            else:
-                params.append((await self.speaker(speaker)).id)
+    async def search_page(
+        self,
+        speaker: Union[Speaker, str, None] = None,
+        subject: Optional[str] = None,
+        limit: int = 10,
+        reverse: bool = False,
+        after: Optional[str] = None,
+    ) -> Page:
+        """
+        Like `search()`, but returns one page of quotes at a time.
 
-        if subject:
-            wheres.append("text like ?")
-            params.append(f"%{subject}%")
+        Pass the `after` token of the returned page to get the page that follows it,
+        using the same filters and ordering. The last page has no `after` token.
+        """
+        if limit < 1:
+            raise ValueError(f"limit must be at least 1, got {limit!r}")
+
+        episodes = await self._episode_map()
+        speakers = await self.speakers()
+        rows = await self._search_rows(
+            "search_page",
+            self._speaker_id(speaker, speakers),
+            subject,
+            limit + 1,
+            reverse,
+            after=page_key(after) if after else None,
+        )
+        quotes = self._quotes(rows, episodes, speakers)
+        if len(quotes) > limit:
+            quotes = quotes[:limit]
+            return Page(quotes, page_token(quotes[-1]))
+        return Page(quotes, None)
+
+    async def iter_search(
+        self,
+        speaker: Union[Speaker, str, None] = None,
+        subject: Optional[str] = None,
+        limit: int = 0,
+        reverse: bool = False,
+        random: bool = False,
+        batch_size: int = 100,
+    ) -> AsyncIterator[Quote]:
+        """
+        Like `search()`, but yields quotes as they are read, `batch_size` at a time.
+
+        Over the default view, every quote is read from a single cursor, on a separate
+        connection that is held until the generator finishes or is closed. Over real
+        tables, each batch is a separate query that seeks past the previous one. Either
+        way, no pooled connection is held between batches. Unlike `search()`, `limit`
+        defaults to all matching quotes.
+        """
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be at least 1, got {batch_size!r}")
 
-        if wheres:
-            where = " and ".join(wheres)
-            query += f" where {where}"
+        episodes = await self._episode_map()
+        speakers = await self.speakers()
+        speaker_id = self._speaker_id(speaker, speakers)
 
         if random:
-            query += " order by RANDOM()"
-        elif reverse:
-            query += " order by episode_id desc, utterance_number desc"
-        else:
-            query += " order by episode_id asc, utterance_number asc"
-
-        if limit > 0:
-            query += " limit ?"
-            params.append(limit)
-
-        results: List[Quote] = []
-        async with self.db.execute(query, params) as cursor:
-            async for row in cursor:
-                episode = await self.episode(row["episode_id"])
-                if episode is None:
-                    raise ValueError(f"episode_id {row['episode_id']} not found")
-                results.append(
-                    Quote(
-                        id=row["id"],
-                        episode=episode,
-                        number=row["utterance_number"],
-                        speaker=await self.speaker(row["speaker"]),
-                        text=row["text"],
-                    )
-                )
+            # shuffle the matching ids, then fetch their quotes a batch at a time
+            rows = await self._search_rows(
+                "iter_search", speaker_id, subject, limit, random=True, columns="id"
+            )
+            ids = [row[0] for row in rows]
+            for start in range(0, len(ids), batch_size):
+                batch = ids[start : start + batch_size]
+                quotes = await self.quotes(batch)
+                for id in batch:
+                    yield quotes[id]
+            return
+
+        if not (self.materialize or self.compiled) and (
+            self.columns is None or (subject and self.fts)
+        ):
+            # each query of the view groups every sentence again, so read it once
+            query, params = self._search_query(speaker_id, subject, limit, reverse)
+            stream = self._stream("iter_search", query, params, batch_size)
+            try:
+                with fts_errors(query, subject):
+                    async for rows in stream:
+                        for quote in self._quotes(rows, episodes, speakers):
+                            yield quote
+            finally:
+                # give the connection back now, rather than when garbage collected
+                await stream.aclose()
+            return
+
+        # seek past the last row of each batch, so every batch costs the same
+        after: Optional[Tuple[int, int]] = None
+        remaining = limit
+        while True:
+            size = min(batch_size, remaining) if limit > 0 else batch_size
+            rows = await self._search_rows(
+                "iter_search", speaker_id, subject, size, reverse, after=after
+            )
+            for quote in self._quotes(rows, episodes, speakers):
+                yield quote
+
+            remaining -= len(rows)
+            if len(rows) < size or (limit > 0 and remaining <= 0):
+                return
+            after = (rows[-1][1], rows[-1][2])
+
+    @cached
+    async def _quote_ids(self) -> Tuple["array[int]", Dict[str, "array[int]"]]:
+        everyone: "array[int]" = array("l")
+        by_speaker: Dict[str, "array[int]"] = {}
+        query = """
+            select u.id, u.speaker
+            from utterance u
+            where u.id in (select utterance_id from sentence)
+            order by u.id
+        """
+        if self.compiled:
+            query = "select id, speaker from quote order by id"
+        rows = await self._fetchall("quote_ids", query)
+        for row in rows:
+            everyone.append(row["id"])
+            by_speaker.setdefault(row["speaker"], array("l")).append(row["id"])
+        return everyone, by_speaker
 
-        return results
+    async def _sample_ids(self, speaker: Optional[str] = None) -> "array[int]":
+        everyone, by_speaker = await self._quote_ids()
+        if speaker is None:
+            return everyone
+        return by_speaker.get(speaker, array("l"))
 
     async def random(
         self, speaker: Union[Speaker, str, None] = None, subject: Optional[str] = None
     ) -> Optional[Quote]:
-        quotes = await self.search(
-            speaker=speaker, subject=subject, limit=1, random=True
-        )
+        if subject:
+            quotes = await self.search(
+                speaker=speaker, subject=subject, limit=1, random=True
+            )
+            if quotes:
+                return quotes[0]
+            return None
+
+        speakers = await self.speakers()
+        speaker_id = self._speaker_id(speaker, speakers)
+        if self.columns is not None:
+            # pick a row directly, since the columns already group rows by speaker
+            row = self.columns.choice(speaker_id)
+            if row is None:
+                return None
+            return self._quotes([row], await self._episode_map(), speakers)[0]
 
-        if quotes:
-            return quotes[0]
+        # pick uniformly from known quote ids rather than sorting the whole view
+        ids = await self._sample_ids(speaker_id)
+        if ids:
+            return await self.quote(choice(ids))
         return None
@@ -0,0 +1,167 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT License
+
+"""
+Suffix array over quote texts, for finding arbitrary substrings without a full scan.
+"""
+
+import re
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from .columns import map_sections, Text, write_sections
+
+# sections are quote ids, text offsets, and suffixes, then the folded text, and the
+# source database the index was built from
+MAGIC = b"AIOSEISA"
+TYPECODES = ("i", "I", "I")
+
+
+def suffix_array(text: bytes, offsets: Sequence[int]) -> "array[int]":
+    """
+    Sort the position of every suffix that starts within a text, up to its end.
+
+    Texts are separated by NUL bytes. Suffixes are first split into buckets by their
+    first two bytes, and each bucket is then sorted on its own, so that only one
+    bucket's sort keys are in memory at a time. Suffixes that are equal up to the
+    end of their texts stay in no particular order, since no subject can tell them
+    apart.
+    """
+    buckets: Dict[bytes, "array[int]"] = {}
+    for index in range(len(offsets) - 1):
+        for position in range(offsets[index], offsets[index + 1] - 1):
+            key = text[position : position + 2]
+            bucket = buckets.get(key, None)
+            if bucket is None:
+                bucket = buckets[key] = array("I")
+            bucket.append(position)
+
+    # a NUL sorts before every other byte, like the end of a shorter suffix
+    result: "array[int]" = array("I")
+    for key in sorted(buckets):
+        bucket = buckets.pop(key)
+        result.extend(
+            sorted(
+                bucket, key=lambda position: text[position : text.index(0, position)]
+            )
+        )
+    return result
+
+
+def needle(subject: str) -> bytes:
+    """The longest literal part of a `LIKE` subject, folded like the indexed text"""
+    return max(re.split(r"[%_]", subject), key=len).encode().lower()
+
+
+class SuffixIndex:
+    """
+    Suffix array over the ASCII-lowered text of every quote.
+
+    Finding every quote that contains a substring takes two binary searches over the
+    suffixes, comparing against the text, then one more per match to find its quote.
+    The index is saved to a file of sections that is mapped read-only when opened,
+    along with an opaque `source` string that identifies the database it indexes.
+    """
+
+    def __init__(
+        self,
+        ids: Sequence[int],
+        offsets: Sequence[int],
+        suffixes: Sequence[int],
+        folded: Text,
+        source: str = "",
+        close: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.ids = ids
+        self.offsets = offsets
+        self.suffixes = suffixes
+        self.folded = folded
+        self.source = source
+        self._close = close
+
+    @classmethod
+    def from_rows(
+        cls, rows: Iterable[Sequence[Any]], source: str = ""
+    ) -> "SuffixIndex":
+        """Build the index from rows of quote id and text"""
+        ids = array("i")
+        offsets = array("I", [0])
+        texts: List[bytes] = []
+        for id, text in rows:
+            data = (text or "").encode().lower() + b"\x00"
+            ids.append(id)
+            texts.append(data)
+            offsets.append(offsets[-1] + len(data))
+
+        folded = b"".join(texts)
+        return cls(ids, offsets, suffix_array(folded, offsets), folded, source)
+
+    @classmethod
+    def open(cls, path: Union[str, Path]) -> "SuffixIndex":
+        """Map an index file written by `save()`; call `close()` when finished"""
+        arrays, texts, close = map_sections(
+            path, MAGIC, "substring index", TYPECODES, 2
+        )
+        ids, offsets, suffixes = arrays
+        folded, source = texts
+        return cls(ids, offsets, suffixes, folded, str(source[:], "utf-8"), close)
+
+    def save(self, path: Union[str, Path]) -> None:
+        write_sections(
+            path,
+            MAGIC,
+            [self.ids, self.offsets, self.suffixes],
+            [self.folded, self.source.encode()],
+        )
+
+    def close(self) -> None:
+        if self._close is not None:
+            self._close()
+            self._close = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def span(self, needle: bytes) -> Tuple[int, int]:
+        """The range of suffixes that start with `needle`"""
+        suffixes, folded, size = self.suffixes, self.folded, len(needle)
+        lo, hi = 0, len(suffixes)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            position = suffixes[mid]
+            if folded[position : position + size] < needle:
+                lo = mid + 1
+            else:
+                hi = mid
+        start, hi = lo, len(suffixes)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            position = suffixes[mid]
+            if folded[position : position + size] == needle:
+                lo = mid + 1
+            else:
+                hi = mid
+        return start, lo
+
+    def find(self, subject: str, limit: Optional[int] = None) -> Optional[List[int]]:
+        """
+        Ids of quotes that may match `subject` with `LIKE`, in id order.
+
+        Without wildcards in the subject, every id matches exactly. Returns None if
+        the subject has no literal part, or if more than `limit` suffixes match, when
+        a full scan is likely to be faster than the index.
+        """
+        literal = needle(subject)
+        if not literal:
+            return None
+        start, end = self.span(literal)
+        if limit is not None and end - start > limit:
+            return None
+
+        offsets, suffixes = self.offsets, self.suffixes
+        rows = {
+            bisect_right(offsets, suffixes[index]) - 1 for index in range(start, end)
+        }
+        return sorted(self.ids[row] for row in rows)
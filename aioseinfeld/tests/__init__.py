@@ -1,4 +1,5 @@
 # Copyright 2022 Amethyst Reese
 # Licensed under the MIT license
 
+from .corpus import CorpusTest
 from .smoke import SmokeTest
@@ -0,0 +1,481 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT license
+
+import gc
+import io
+import json
+import os
+import re
+import shutil
+import sqlite3
+from contextlib import redirect_stderr
+from dataclasses import fields
+from functools import partial
+from itertools import product
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from aiounittest import AsyncTestCase
+
+from aioseinfeld import Seinfeld, Tuning
+from aioseinfeld.__main__ import main as cli
+from aioseinfeld.bench import main as bench
+from aioseinfeld.corpus import generate, SPEAKERS
+from aioseinfeld.seinfeld import search_sql
+
+
+class CorpusTest(AsyncTestCase):
+    """
+    Tests against a small synthetic database, that run without network access.
+    """
+
+    maxDiff = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.td = TemporaryDirectory()
+        cls.db = generate(
+            Path(cls.td.name) / "synthetic.db", episodes=12, utterances=60, seasons=3
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.td.cleanup()
+
+    def test_generate(self):
+        with TemporaryDirectory() as td:
+            a = generate(Path(td) / "a.db", episodes=2, utterances=5, seed=7)
+            b = generate(Path(td) / "b.db", episodes=2, utterances=5, seed=7)
+            self.assertEqual(a.read_bytes(), b.read_bytes())
+
+            with self.assertRaises(ValueError):
+                generate(a)
+
+    async def test_episodes(self):
+        async with Seinfeld(self.db) as seinfeld:
+            seasons = await seinfeld.seasons()
+            self.assertEqual(list(seasons), [1, 2, 3])
+            for season in seasons.values():
+                self.assertEqual(len(await season.episodes), 4)
+            self.assertEqual(len(await seinfeld.episodes()), 12)
+
+            seinfeld.invalidate("seasons")
+            season = await seinfeld.season(2)
+            self.assertIsNot(season, seasons[2])
+            for episode in await season.episodes:
+                self.assertIs(episode.season, season)
+            self.assertIs((await seinfeld.episode(episode.id)).season, season)
+
+            seinfeld.invalidate("episodes")
+            season = await seinfeld.season(2)
+            for episode in await season.episodes:
+                self.assertIs(await seinfeld.episode(episode.id), episode)
+            with self.assertRaisesRegex(ValueError, "_episode_map"):
+                seinfeld.invalidate("_episode_map")
+
+    async def test_modes(self):
+        async with Seinfeld(self.db) as seinfeld:
+            expected = [
+                await seinfeld.search(limit=0),
+                await seinfeld.search(speaker="jerry", reverse=True, limit=50),
+                await seinfeld.search(subject="a", limit=0),
+            ]
+            seed = await seinfeld.quote(100)
+            passage = await seinfeld.passage(seed, length=7)
+            self.assertEqual(seed.id, 100)
+
+        for kwargs in (
+            dict(materialize=True),
+            dict(pool_size=3),
+            dict(in_memory=True),
+            dict(tuning=True),
+            dict(tuning=True, materialize=True, pool_size=2),
+            dict(tuning=Tuning(immutable=False, mmap_size=None), in_memory=True),
+            dict(engine="columnar"),
+        ):
+            with self.subTest(**kwargs):
+                async with Seinfeld(self.db, **kwargs) as seinfeld:
+                    results = [
+                        await seinfeld.search(limit=0),
+                        await seinfeld.search(speaker="jerry", reverse=True, limit=50),
+                        await seinfeld.search(subject="a", limit=0),
+                    ]
+                    self.assertEqual(results, expected)
+                    self.assertEqual(await seinfeld.quote(100), seed)
+                    self.assertEqual(await seinfeld.passage(seed, length=7), passage)
+
+    async def test_iter_search_and_pages(self):
+        async with Seinfeld(self.db, materialize=True) as seinfeld:
+            for reverse in (False, True):
+                with self.subTest(reverse=reverse):
+                    expected = await seinfeld.search(
+                        speaker="george", limit=0, reverse=reverse
+                    )
+                    quotes = [
+                        quote
+                        async for quote in seinfeld.iter_search(
+                            speaker="george", reverse=reverse, batch_size=7
+                        )
+                    ]
+                    self.assertEqual(quotes, expected)
+
+                    quotes = []
+                    after = None
+                    while True:
+                        page = await seinfeld.search_page(
+                            speaker="george", limit=7, reverse=reverse, after=after
+                        )
+                        quotes.extend(page.quotes)
+                        after = page.after
+                        if after is None:
+                            break
+                    self.assertEqual(quotes, expected)
+
+            quotes = [q async for q in seinfeld.iter_search(random=True, limit=20)]
+            self.assertEqual(len(set(quotes)), 20)
+
+        # over the view, other queries can run between batches
+        async with Seinfeld(self.db) as seinfeld:
+            for reverse in (False, True):
+                expected = await seinfeld.search(
+                    speaker="george", limit=0, reverse=reverse
+                )
+                quotes = []
+                search = seinfeld.iter_search("george", reverse=reverse, batch_size=7)
+                async for quote in search:
+                    self.assertEqual(await seinfeld.quote(quote.id), quote)
+                    quotes.append(quote)
+                self.assertEqual(quotes, expected)
+
+            search = seinfeld.iter_search(limit=30, batch_size=7)
+            self.assertEqual(len([quote async for quote in search]), 30)
+
+    async def test_columnar(self):
+        subjects = [None, "a", "Th", "x_z", "a%e", "%", "!"]
+        speakers = [None, "jerry", "NEWMAN", "nobody"]
+
+        async def results(seinfeld):
+            found = []
+            for speaker, subject, reverse in product(speakers, subjects, (False, True)):
+                kwargs = dict(speaker=speaker, subject=subject, reverse=reverse)
+                found.append(await seinfeld.search(**kwargs, limit=0))
+                found.append(await seinfeld.search(**kwargs, limit=3))
+                page = await seinfeld.search_page(**kwargs, limit=4)
+                found.append(await seinfeld.search_page(**kwargs, after=page.after))
+                quotes = await seinfeld.search(**kwargs, random=True, limit=0)
+                found.append(sorted(quotes, key=lambda q: q.id))
+            found.append(list((await seinfeld.quotes(range(700, 0, -7))).values()))
+            return found
+
+        async with Seinfeld(self.db) as seinfeld:
+            expected = await results(seinfeld)
+        async with Seinfeld(self.db, engine="columnar") as seinfeld:
+            self.assertIsNotNone(seinfeld.columns)
+            self.assertEqual(await results(seinfeld), expected)
+
+        with self.assertRaisesRegex(ValueError, "engine"):
+            Seinfeld(self.db, engine="numpy")
+
+    async def test_snapshot(self):
+        with TemporaryDirectory() as td:
+            path = Path(td) / "synthetic.snapshot"
+            async with Seinfeld(self.db) as seinfeld:
+                self.assertEqual(await seinfeld.snapshot(path), path)
+                expected = [
+                    await seinfeld.search(limit=0),
+                    await seinfeld.search(speaker="jerry", subject="a", reverse=True),
+                    await seinfeld.passage(await seinfeld.quote(100), length=7),
+                ]
+
+            async with Seinfeld(self.db, snapshot=path) as seinfeld:
+                self.assertEqual(seinfeld.engine, "columnar")
+                self.assertEqual(len(seinfeld.columns), len(expected[0]))
+                results = [
+                    await seinfeld.search(limit=0),
+                    await seinfeld.search(speaker="jerry", subject="a", reverse=True),
+                    await seinfeld.passage(await seinfeld.quote(100), length=7),
+                ]
+                self.assertEqual(results, expected)
+
+                # random quotes are picked from the mapped rows, without an id list
+                jerry = await seinfeld.speaker("jerry")
+                for _ in range(5):
+                    quote = await seinfeld.random(speaker=jerry)
+                    self.assertEqual(quote.speaker, jerry)
+                    self.assertIn(await seinfeld.random(), expected[0])
+                self.assertIsNone(await seinfeld.random(speaker="nobody"))
+                self.assertNotIn(("_quote_ids", ()), seinfeld._cache)
+
+                # a snapshot of a snapshot is the same file
+                copy = await seinfeld.snapshot(Path(td) / "copy.snapshot")
+                self.assertEqual(copy.read_bytes(), path.read_bytes())
+
+            with self.assertRaisesRegex(ValueError, "does not exist"):
+                Seinfeld(self.db, snapshot=Path(td) / "missing.snapshot")
+            with self.assertRaisesRegex(ValueError, "not a compatible snapshot"):
+                async with Seinfeld(self.db, snapshot=self.db):
+                    pass
+
+    async def test_substring_index(self):
+        subjects = ["a", "th", "E T", "x_z", "a%e", "%", "qqqqq", "overdr"]
+
+        async def results(seinfeld):
+            found = []
+            for subject, speaker in product(subjects, (None, "jerry")):
+                found.append(
+                    await seinfeld.search(speaker=speaker, subject=subject, limit=0)
+                )
+                found.append(await seinfeld.search(subject=subject, reverse=True))
+            return found
+
+        async with Seinfeld(self.db, materialize=True) as seinfeld:
+            expected = await results(seinfeld)
+
+        with TemporaryDirectory() as td:
+            db = Path(td) / "synthetic.db"
+            shutil.copy(self.db, db)
+
+            async with Seinfeld(db, materialize=True) as seinfeld:
+                await seinfeld.build_substring_index()
+                self.assertTrue(seinfeld.suffix_path.is_file())
+                self.assertEqual(await results(seinfeld), expected)
+
+                # plain subjects are found as substrings even with full-text search
+                await seinfeld.build_index()
+                self.assertEqual(await results(seinfeld), expected)
+                quote = await seinfeld.random(subject="qu")
+                self.assertIn("qu", quote.text.lower())
+
+            async with Seinfeld(db) as seinfeld:
+                self.assertIsNotNone(seinfeld.suffixes)
+                self.assertEqual(await results(seinfeld), expected)
+
+            # replacing the database leaves the index behind, but it is ignored
+            generate(Path(td) / "other.db", episodes=3, utterances=20, seed=3)
+            os.replace(Path(td) / "other.db", db)
+            with self.assertLogs("aioseinfeld", "WARNING"):
+                async with Seinfeld(db) as seinfeld:
+                    self.assertIsNone(seinfeld.suffixes)
+                    await seinfeld.build_substring_index()
+                    self.assertIsNotNone(seinfeld.suffixes)
+                    self.assertEqual(
+                        await seinfeld.search(subject="a", limit=0),
+                        [
+                            q
+                            for q in await seinfeld.search(limit=0)
+                            if "a" in q.text.lower()
+                        ],
+                    )
+
+    async def test_pattern(self):
+        patterns = [r"\bno\b", r"^[A-Z]\w+\?$", re.compile("ST", re.I), "qqqqq"]
+
+        async with Seinfeld(self.db, scan_workers=2) as seinfeld:
+            everything = await seinfeld.search(limit=0)
+            jerry = await seinfeld.speaker("jerry")
+            for pattern, speaker in product(patterns, (None, jerry)):
+                expected = [
+                    quote
+                    for quote in everything
+                    if re.search(pattern, quote.text)
+                    and speaker in (None, quote.speaker)
+                ]
+                search = partial(seinfeld.search, speaker, pattern=pattern)
+                self.assertEqual(await search(limit=0), expected)
+                self.assertEqual(await search(limit=5), expected[:5])
+                self.assertEqual(await search(reverse=True), expected[::-1][:10])
+                found = await search(limit=5, random=True)
+                self.assertEqual(len(found), min(5, len(expected)))
+                for quote in found:
+                    self.assertIn(quote, expected)
+
+            self.assertEqual(await seinfeld.search("nobody", pattern="a"), [])
+            with self.assertRaises(ValueError):
+                await seinfeld.search(subject="a", pattern="a")
+
+    async def test_batches(self):
+        async with Seinfeld(self.db) as seinfeld:
+            ids = list(range(700, 0, -3))
+            quotes = await seinfeld.quotes(ids)
+            self.assertEqual(list(quotes), [id for id in ids if id in quotes])
+            for id in ids[:10]:
+                self.assertEqual(quotes.get(id), await seinfeld.quote(id))
+
+            seeds = list(quotes.values())
+            passages = await seinfeld.passages(seeds, length=5)
+            for seed, passage in zip(seeds, passages):
+                self.assertEqual(passage, await seinfeld.passage(seed, length=5))
+
+            # passages keep their hash as their quotes change
+            passage = passages[0]
+            found = {passage}
+            passage.quotes.append(seeds[-1])
+            self.assertIn(passage, found)
+
+    async def test_random(self):
+        async with Seinfeld(self.db) as seinfeld:
+            for name in SPEAKERS[:5]:
+                speaker = await seinfeld.speaker(name)
+                quotes = await seinfeld.search(speaker=speaker, limit=0)
+                for _ in range(5):
+                    self.assertIn(await seinfeld.random(speaker=speaker), quotes)
+            self.assertIsNone(await seinfeld.random(speaker="nobody"))
+
+            # ad hoc speakers are interned while referenced, and not kept after
+            nobody = await seinfeld.speaker("not-in-db")
+            self.assertIs(await seinfeld.speaker("not-in-db"), nobody)
+            for index in range(100):
+                await seinfeld.random(speaker=f"nobody{index}")
+            self.assertEqual(list(seinfeld._unknown_speakers), ["not-in-db"])
+            del nobody
+            gc.collect()
+            self.assertEqual(len(seinfeld._unknown_speakers), 0)
+
+    async def test_build_index(self):
+        with TemporaryDirectory() as td:
+            db = Path(td) / "synthetic.db"
+            shutil.copy(self.db, db)
+
+            async with Seinfeld(db, pool_size=2, tuning=True) as seinfeld:
+                with self.assertRaisesRegex(sqlite3.OperationalError, "readonly"):
+                    await seinfeld.db.execute("delete from utterance")
+                quote = await seinfeld.quote(100)
+                word = max(re.findall(r"\w+", quote.text.lower()), key=len)
+                await seinfeld.build_index()
+                quotes = await seinfeld.search(subject=word, limit=0)
+                self.assertIn(quote, quotes)
+                for quote in quotes:
+                    self.assertIn(word, re.findall(r"\w+", quote.text.lower()))
+
+            async with Seinfeld(db) as seinfeld:
+                self.assertTrue(seinfeld.fts)
+                quotes = await seinfeld.search(subject=f"{word[:-1]}*", limit=0)
+                self.assertIn(quote, quotes)
+
+                # double quotes are part of the phrase, not query syntax
+                quotes = await seinfeld.search(subject=f'"{word}', limit=0)
+                self.assertIn(quote, quotes)
+                search = seinfeld.iter_search(subject=f'said "{word} OR', limit=0)
+                self.assertEqual([quote async for quote in search], [])
+
+            # a full-text index built from another version of the database is ignored
+            os.utime(db, ns=(0, 0))
+            with self.assertLogs("aioseinfeld", "WARNING"):
+                async with Seinfeld(db) as seinfeld:
+                    self.assertFalse(seinfeld.fts)
+                    await seinfeld.build_index()
+                    self.assertTrue(seinfeld.fts)
+            async with Seinfeld(db) as seinfeld:
+                self.assertTrue(seinfeld.fts)
+
+    async def test_compile(self):
+        with TemporaryDirectory() as td:
+            db = Path(td) / "synthetic.db"
+            shutil.copy(self.db, db)
+            compiled = Path(td) / "compiled.db"
+            cli(["compile", str(db), str(compiled)])
+            with redirect_stderr(io.StringIO()) as stderr:
+                with self.assertRaises(SystemExit):
+                    cli(["compile", str(db), str(compiled)])
+            self.assertIn("already exists", stderr.getvalue())
+
+            # bad page sizes and failed builds leave nothing behind
+            empty = Path(td) / "empty.db"
+            sqlite3.connect(empty).close()
+            failed = Path(td) / "failed.db"
+            for argv in (
+                ["compile", str(db), str(failed), "--page-size", "1000"],
+                ["compile", str(empty), str(failed)],
+            ):
+                with redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+                    cli(argv)
+                self.assertFalse(failed.exists())
+                self.assertFalse(Path(td, "failed.db.tmp").exists())
+
+            async def results(seinfeld):
+                quote = await seinfeld.quote(100)
+                word = max(re.findall(r"\w+", quote.text.lower()), key=len)
+                return [
+                    await seinfeld.speakers(),
+                    await seinfeld.search(limit=0),
+                    await seinfeld.search(speaker="jerry", subject=word, limit=0),
+                    await seinfeld.search(subject=f"{word[:-1]}*", reverse=True),
+                    await seinfeld.passage(quote, length=7),
+                    await seinfeld._quote_ids(),
+                ]
+
+            async with Seinfeld(db) as seinfeld:
+                self.assertFalse(seinfeld.compiled)
+                await seinfeld.build_index()
+                expected = await results(seinfeld)
+
+            for kwargs in (dict(), dict(tuning=True), dict(engine="columnar")):
+                with self.subTest(**kwargs):
+                    async with Seinfeld(compiled, **kwargs) as seinfeld:
+                        self.assertTrue(seinfeld.compiled)
+                        self.assertTrue(seinfeld.fts)
+                        self.assertEqual(await results(seinfeld), expected)
+
+    def test_bench(self):
+        with TemporaryDirectory() as td, redirect_stderr(io.StringIO()):
+            output = Path(td) / "bench.json"
+            argv = [str(self.db), "-n", "3", "-c", "1", "2", "--cold-runs", "1"]
+            bench(argv + ["-k", "quote*", "-k", "random*", "-o", str(output)])
+            results = json.loads(output.read_text())["results"]
+
+        cases = {(r["case"], r["mode"], r["concurrency"]) for r in results}
+        self.assertIn(("quote", "warm", 2), cases)
+        self.assertIn(("quotes[50]", "cold", 1), cases)
+        self.assertIn(("random[speaker,subject]", "warm", 1), cases)
+        self.assertIn(("open", "cold", 1), cases)
+        for result in results:
+            self.assertLessEqual(result["p50"], result["max"])
+
+    def test_bench_tuning(self):
+        with TemporaryDirectory() as td, redirect_stderr(io.StringIO()):
+            output = Path(td) / "bench.json"
+            argv = [str(self.db), "-n", "2", "-c", "1", "--cold-runs", "1"]
+            bench(argv + ["-k", "passage", "--tuning", "sweep", "-o", str(output)])
+            results = json.loads(output.read_text())["results"]
+
+        profiles = {r["profile"] for r in results if r["case"] == "passage"}
+        self.assertEqual(
+            profiles,
+            {"untuned", "tuned", *(f.name for f in fields(Tuning))},
+        )
+
+    async def test_instrument(self):
+        async with Seinfeld(self.db) as seinfeld:
+            with self.assertRaises(RuntimeError):
+                seinfeld.stats()
+
+        events = []
+        async with Seinfeld(self.db, on_query=events.append, pool_size=2) as seinfeld:
+            await seinfeld.search(limit=5)
+            found = len(await seinfeld.quotes(range(1, 20)))
+            found += len(await seinfeld.quotes(range(1, 40)))
+            stats = seinfeld.stats(reset=True)
+            self.assertEqual(seinfeld.stats(), {"methods": {}, "queries": {}})
+
+        self.assertEqual(stats["methods"]["search"].calls, 1)
+        self.assertEqual(stats["methods"]["search"].rows, 5)
+        self.assertEqual(stats["methods"]["quotes"].calls, 2)
+        self.assertEqual(stats["methods"]["open"].calls, 4)
+        shape = (
+            "select id, episode_id, utterance_number, speaker, text from quote "
+            "where id in (?, ...)"
+        )
+        self.assertEqual(stats["queries"][shape].calls, 2)
+        self.assertEqual(stats["queries"][shape].rows, found)
+        self.assertEqual(len(events), sum(s.calls for s in stats["methods"].values()))
+        for event in events:
+            self.assertGreaterEqual(event.time, event.queued)
+
+    async def test_search_shapes(self):
+        async with Seinfeld(self.db) as seinfeld:
+            await seinfeld.search(speaker="jerry", subject="a", limit=0)
+            await seinfeld.search(speaker="jerry", subject="a", limit=5)
+            shapes = search_sql.cache_info().currsize
+            for limit in range(10):
+                await seinfeld.search(speaker="kramer", subject="b", limit=limit)
+            self.assertEqual(search_sql.cache_info().currsize, shapes)
@@ -1,18 +1,26 @@
 # Copyright 2022 Amethyst Reese
 # Licensed under the MIT license
 
+import asyncio
+import shutil
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
 from aiounittest import AsyncTestCase
 
-from aioseinfeld import Seinfeld, Quote, Passage
+from aioseinfeld import Seinfeld, Quote, Passage, Page
 
 DB = "seinfeld.db"
 
 
+@unittest.skipUnless(Path(DB).is_file(), f"{DB} not found, run `make smoke`")
 class SmokeTest(AsyncTestCase):
     """
     Tests dependent on having a copy of https://noswap.com/pub/seinfeld.db
 
-    `make test` will fetch this artifact before running these tests.
+    These are skipped without it. `make smoke` will fetch this artifact before
+    running all tests.
     """
 
     maxDiff = None
@@ -44,6 +52,32 @@ class SmokeTest(AsyncTestCase):
                 episodes = await seinfeld.episodes()
                 self.assertEqual(len(episodes), sum(expected.values()))
 
+    async def test_episode_identity(self):
+        async with Seinfeld(DB) as seinfeld:
+            episode = await seinfeld.episode(1)
+            self.assertIs(await seinfeld.episode(1), episode)
+            self.assertIs((await seinfeld.quote(78)).episode, episode)
+            self.assertIn(episode, await seinfeld.episodes(episode.season.number))
+            for quote in await seinfeld.search(speaker="jerry", limit=20):
+                self.assertIs(quote.episode, await seinfeld.episode(quote.episode.id))
+
+    async def test_speaker_identity(self):
+        async with Seinfeld(DB) as seinfeld:
+            jerry = await seinfeld.speaker("jerry")
+            self.assertIs(await seinfeld.speaker("Jerry"), jerry)
+            self.assertIs(
+                await seinfeld.speaker("Bania"), await seinfeld.speaker("Bania")
+            )
+            for quote in await seinfeld.search(subject="parking", limit=0):
+                self.assertIs(quote.speaker, await seinfeld.speaker(quote.speaker.id))
+
+    async def test_hashable(self):
+        async with Seinfeld(DB) as seinfeld:
+            quotes = await seinfeld.search(speaker="jerry", limit=0)
+            self.assertEqual(len(set(quotes)), len(quotes))
+            self.assertEqual({quote.speaker for quote in quotes}, {quotes[0].speaker})
+            self.assertFalse(hasattr(quotes[0], "__dict__"))
+
     async def test_quote_by_id(self):
         async with Seinfeld(DB) as seinfeld:
             episode = await seinfeld.episode(1)
@@ -60,6 +94,15 @@ class SmokeTest(AsyncTestCase):
             quote = await seinfeld.quote(78)
             self.assertEqual(quote, expected)
 
+    async def test_quotes_by_id(self):
+        async with Seinfeld(DB) as seinfeld:
+            ids = [7485, 78, 0, 78] + list(range(1000, 3000))
+            quotes = await seinfeld.quotes(ids)
+            self.assertEqual(list(quotes)[:2], [7485, 78])
+            self.assertNotIn(0, quotes)
+            for id in (7485, 78, 1000, 2999):
+                self.assertEqual(quotes[id], await seinfeld.quote(id))
+
     async def test_passage(self):
         async with Seinfeld(DB) as seinfeld:
             episode = await seinfeld.episode(1)
@@ -123,6 +166,14 @@ class SmokeTest(AsyncTestCase):
                 self.assertEqual(passage.quotes[index].text, exp.text)
             self.assertEqual(passage, expected)
 
+    async def test_passages(self):
+        async with Seinfeld(DB) as seinfeld:
+            seeds = list((await seinfeld.quotes([78, 80, 7485, 1])).values())
+            passages = await seinfeld.passages(seeds, length=5)
+            self.assertEqual(len(passages), len(seeds))
+            for seed, passage in zip(seeds, passages):
+                self.assertEqual(passage, await seinfeld.passage(seed, length=5))
+
     async def test_search_specific(self):
         async with Seinfeld(DB) as seinfeld:
             episode = await seinfeld.episode(26)
@@ -154,9 +205,159 @@ class SmokeTest(AsyncTestCase):
                 self.assertEqual(quote.speaker, jerry)
                 self.assertIn("parking", quote.text)
 
+    async def test_search_unlimited(self):
+        async with Seinfeld(DB) as seinfeld:
+            george = await seinfeld.speaker("george")
+            quotes = await seinfeld.search(speaker=george, limit=0)
+            self.assertGreater(len(quotes), 10)
+            self.assertEqual(quotes[:10], await seinfeld.search(speaker=george))
+            keys = [(q.episode.id, q.number) for q in quotes]
+            self.assertEqual(keys, sorted(keys))
+            for quote in quotes:
+                self.assertIs(quote.speaker, george)
+
     async def test_random(self):
         async with Seinfeld(DB) as seinfeld:
             jerry = await seinfeld.speaker("jerry")
             for i in range(10):
                 quote = await seinfeld.random(speaker="jerry")
                 self.assertEqual(quote.speaker, jerry)
+
+    async def test_materialize(self):
+        async with Seinfeld(DB) as seinfeld:
+            seed = await seinfeld.quote(78)
+            passage = await seinfeld.passage(seed)
+            quotes = await seinfeld.search(speaker="jerry", subject="parking")
+
+        async with Seinfeld(DB, materialize=True) as seinfeld:
+            self.assertEqual(await seinfeld.quote(78), seed)
+            self.assertEqual(await seinfeld.passage(seed), passage)
+            self.assertEqual(
+                await seinfeld.search(speaker="jerry", subject="parking"), quotes
+            )
+
+    async def test_build_index(self):
+        with TemporaryDirectory() as td:
+            db = Path(td) / "seinfeld.db"
+            shutil.copy(DB, db)
+
+            async with Seinfeld(db) as seinfeld:
+                expected = await seinfeld.search(subject="My mother goes babbling")
+                self.assertFalse(seinfeld.fts)
+                await seinfeld.build_index()
+                self.assertTrue(seinfeld.fts)
+                quotes = await seinfeld.search(subject="My mother goes babbling")
+                self.assertEqual(quotes, expected)
+
+            async with Seinfeld(db) as seinfeld:
+                self.assertTrue(seinfeld.fts)
+                quotes = await seinfeld.search(subject="babbl*")
+                self.assertIn(expected[0], quotes)
+                quotes = await seinfeld.search(subject="overdr")
+                self.assertEqual(quotes, [])
+
+    async def test_random_covers_search(self):
+        async with Seinfeld(DB) as seinfeld:
+            quotes = await seinfeld.search(speaker="newman", limit=0)
+            for i in range(20):
+                self.assertIn(await seinfeld.random(speaker="newman"), quotes)
+            self.assertIsNone(await seinfeld.random(speaker="not a speaker"))
+
+    async def test_pool(self):
+        async with Seinfeld(DB) as seinfeld:
+            expected = await seinfeld.search(subject="parking", limit=0)
+
+        async with Seinfeld(DB, pool_size=4) as seinfeld:
+            results = await asyncio.gather(
+                *[seinfeld.search(subject="parking", limit=0) for _ in range(8)]
+            )
+            for quotes in results:
+                self.assertEqual(quotes, expected)
+
+    async def test_in_memory(self):
+        async with Seinfeld(DB) as seinfeld:
+            seed = await seinfeld.quote(78)
+            passage = await seinfeld.passage(seed)
+
+        async with Seinfeld(DB, in_memory=True, pool_size=2) as seinfeld:
+            self.assertGreater(seinfeld.load_size, 0)
+            self.assertGreaterEqual(seinfeld.load_time, 0)
+            self.assertEqual(await seinfeld.quote(78), seed)
+            self.assertEqual(await seinfeld.passage(seed), passage)
+
+    async def test_cached(self):
+        async with Seinfeld(DB) as seinfeld:
+            results = await asyncio.gather(*[seinfeld.speakers() for _ in range(5)])
+            for speakers in results:
+                self.assertIs(speakers, results[0])
+
+            seasons = await seinfeld.seasons()
+            seinfeld.invalidate("speakers")
+            self.assertIsNot(await seinfeld.speakers(), results[0])
+            self.assertEqual(await seinfeld.speakers(), results[0])
+            self.assertIs(await seinfeld.seasons(), seasons)
+
+            seinfeld.invalidate()
+            self.assertIsNot(await seinfeld.seasons(), seasons)
+
+        async with Seinfeld(DB) as seinfeld:
+            self.assertIsNot(await seinfeld.seasons(), seasons)
+
+    async def test_season_episodes_shared(self):
+        async with Seinfeld(DB) as seinfeld:
+            season = await seinfeld.season(3)
+            results = await asyncio.gather(*[season.episodes for _ in range(5)])
+            for episodes in results:
+                self.assertIs(episodes, results[0])
+
+            episode = results[0][0]
+            self.assertIs(episode.season, season)
+            self.assertIs(await episode.season.episodes, results[0])
+
+    async def test_iter_search(self):
+        async with Seinfeld(DB, materialize=True) as seinfeld:
+            expected = await seinfeld.search(
+                speaker="jerry", subject="parking", limit=0
+            )
+            quotes = [
+                quote
+                async for quote in seinfeld.iter_search(
+                    speaker="jerry", subject="parking", batch_size=3
+                )
+            ]
+            self.assertEqual(quotes, expected)
+
+            expected = await seinfeld.search(limit=25, reverse=True)
+            quotes = [
+                quote
+                async for quote in seinfeld.iter_search(
+                    limit=25, reverse=True, batch_size=10
+                )
+            ]
+            self.assertEqual(quotes, expected)
+
+    async def test_search_page(self):
+        async with Seinfeld(DB, materialize=True) as seinfeld:
+            for reverse in (False, True):
+                with self.subTest(reverse=reverse):
+                    expected = await seinfeld.search(
+                        speaker="jerry", subject="parking", limit=0, reverse=reverse
+                    )
+                    quotes = []
+                    page = Page([], None)
+                    while True:
+                        page = await seinfeld.search_page(
+                            speaker="jerry",
+                            subject="parking",
+                            limit=4,
+                            reverse=reverse,
+                            after=page.after,
+                        )
+                        self.assertLessEqual(len(page.quotes), 4)
+                        quotes.extend(page.quotes)
+                        if page.after is None:
+                            break
+                    self.assertEqual(quotes, expected)
+
+            with self.assertRaises(ValueError):
+                await seinfeld.search_page(after="not a token")
@@ -2,26 +2,44 @@
 # Licensed under the MIT License
 
 import datetime as dt
-from dataclasses import dataclass, field
-from typing import List, Optional, Awaitable, Dict, NewType
+from dataclasses import dataclass
+from typing import List, Optional, Awaitable, Dict, NewType, cast
 
 Name = NewType("Name", str)
 
 
 @dataclass
 class Speaker:
+    # weak references let instances intern ad hoc speakers without keeping them
+    __slots__ = ("id", "name", "__weakref__")
+
     id: str
     name: Name
 
+    def __hash__(self) -> int:
+        return hash(self.id)
 
-@dataclass
+
+@dataclass(eq=False)
 class Season:
+    __slots__ = ("number", "episodes")
+
     number: int
-    episodes: Awaitable["Episodes"] = field(compare=False)
+    episodes: Awaitable["Episodes"]
+
+    def __eq__(self, other: object) -> bool:
+        if other.__class__ is self.__class__:
+            return self.number == cast(Season, other).number
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.number)
 
 
 @dataclass
 class Episode:
+    __slots__ = ("id", "season", "number", "title", "date", "writers", "director")
+
     id: int
     season: Season
     number: int
@@ -30,26 +48,91 @@ class Episode:
     writers: List[Name]
     director: Name
 
+    def __hash__(self) -> int:
+        return hash(self.id)
+
 
 @dataclass
 class Quote:
     """One or more sentences from a single speaker in a single episode"""
 
+    __slots__ = ("id", "episode", "number", "speaker", "text")
+
     id: int
     episode: Episode
     number: int
     speaker: Speaker
     text: str
 
+    def __hash__(self) -> int:
+        return hash(self.id)
+
 
 @dataclass
 class Passage:
     """One or more quotes from a single episode"""
 
+    __slots__ = ("id", "episode", "quotes")
+
     id: int
     episode: Episode
     quotes: List[Quote]
 
+    def __hash__(self) -> int:
+        return hash(self.id)
+
+
+@dataclass
+class Page:
+    """One page of search results, and the token to fetch the next page"""
+
+    __slots__ = ("quotes", "after")
+
+    quotes: List[Quote]
+    after: Optional[str]
+
+
+@dataclass
+class QueryEvent:
+    """Timing of a single database query, as passed to `on_query` callbacks"""
+
+    __slots__ = ("method", "query", "rows", "time", "queued")
+
+    method: str
+    query: str
+    rows: int
+    time: float
+    queued: float
+
+
+@dataclass
+class QueryStats:
+    """Totals for all queries from one method, or with one query shape"""
+
+    __slots__ = ("calls", "rows", "time", "queued")
+
+    calls: int
+    rows: int
+    time: float
+    queued: float
+
+
+@dataclass(frozen=True)
+class Tuning:
+    """
+    Connection settings for read-heavy workloads, see `Seinfeld(tuning=...)`
+
+    The defaults open the database as a read-only, immutable file, so SQLite can
+    skip locking and change detection, and read through a memory map and a large
+    page cache. Use `None` or `False` to leave any one setting at SQLite's default.
+    """
+
+    immutable: bool = True
+    mmap_size: Optional[int] = 256 * 1024 * 1024
+    cache_size: Optional[int] = -64 * 1024  # negative values are in KiB
+    temp_store: Optional[str] = "memory"
+    query_only: bool = True
+
 
 Speakers = Dict[str, Speaker]
 Episodes = List[Episode]